@@ -0,0 +1,64 @@
+import hashlib
+import json
+import threading
+import uuid
+
+from django.core.cache import cache
+
+from api.serializers import TagSerializer
+from recipes.models import Tag
+
+TAG_CATALOG_CACHE_KEY = 'tags_catalog'
+
+_tag_catalog = None
+_tag_catalog_lock = threading.Lock()
+
+
+def get_version(key):
+    # Версия — случайный токен, а не счётчик: после вытеснения ключа из
+    # кэша появляется новый токен, который не совпадёт ни с одной из
+    # прежних версий.
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(key):
+    cache.set(key, uuid.uuid4().hex, timeout=None)
+
+
+class TagCatalog:
+    def __init__(self, data, version):
+        self.data = data
+        self.version = version
+        content = json.dumps(data, ensure_ascii=False, sort_keys=True)
+        self.etag = '"{}"'.format(
+            hashlib.md5(content.encode()).hexdigest())
+
+
+def get_tag_catalog():
+    # Версия хранится в одной записи с данными, поэтому вытеснение
+    # записи приводит только к перестроению каталога.
+    global _tag_catalog
+    entry = cache.get(TAG_CATALOG_CACHE_KEY)
+    catalog = _tag_catalog
+    if (entry is not None and catalog is not None
+            and catalog.version == entry[0]):
+        return catalog
+    with _tag_catalog_lock:
+        if entry is None:
+            data = [dict(tag) for tag in TagSerializer(
+                Tag.objects.all(), many=True).data]
+            entry = (uuid.uuid4().hex, data)
+            cache.set(TAG_CATALOG_CACHE_KEY, entry, timeout=None)
+        if _tag_catalog is None or _tag_catalog.version != entry[0]:
+            _tag_catalog = TagCatalog(entry[1], entry[0])
+        return _tag_catalog
+
+
+def invalidate_tag_catalog():
+    global _tag_catalog
+    _tag_catalog = None
+    cache.delete(TAG_CATALOG_CACHE_KEY)
@@ -0,0 +1,38 @@
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import Recipe, UserFavoritedRecipe
+from users.models import Follow, User
+
+
+def change_counter(queryset, field, delta):
+    # Счётчики хранятся в PositiveIntegerField, поэтому уменьшение
+    # не опускает значение ниже нуля даже при рассинхронизации.
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    queryset.update(**{field: F(field) + delta})
+
+
+def count_related(queryset, field):
+    return Coalesce(Subquery(
+        queryset.filter(**{field: OuterRef('pk')}).order_by()
+        .values(field).annotate(count=Count('pk')).values('count')
+    ), 0)
+
+
+COUNTERS = (
+    (Recipe, 'favorites_counter', UserFavoritedRecipe, 'recipe'),
+    (User, 'recipes_counter', Recipe, 'author'),
+    (User, 'followers_counter', Follow, 'following'),
+)
+
+
+def recount_counters():
+    fixed = {}
+    for model, field, related_model, related_field in COUNTERS:
+        actual = count_related(related_model.objects.all(), related_field)
+        drifted = model.objects.annotate(actual=actual).exclude(
+            **{field: F('actual')}).values('pk')
+        fixed[f'{model._meta.label}.{field}'] = model.objects.filter(
+            pk__in=drifted).update(**{field: actual})
+    return fixed
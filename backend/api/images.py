@@ -0,0 +1,219 @@
+import io
+import logging
+import os
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import DatabaseError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from PIL import Image, ImageOps, UnidentifiedImageError, features
+
+from recipes.models import Recipe, RecipeImageJob
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONS = {'WEBP': 'webp', 'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif'}
+SIGNATURES = (
+    (b'\xff\xd8\xff', 'JPEG'),
+    (b'\x89PNG\r\n\x1a\n', 'PNG'),
+    (b'GIF87a', 'GIF'),
+    (b'GIF89a', 'GIF'),
+)
+
+
+def sniff_image_format(head):
+    # Формат определяется по первым байтам файла, чтобы отклонять
+    # не изображения до декодирования всей загрузки.
+    for signature, image_format in SIGNATURES:
+        if head.startswith(signature):
+            return image_format
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'WEBP'
+    return None
+
+
+def get_derivative_format():
+    image_format = settings.RECIPE_IMAGE_FORMAT.upper()
+    if image_format == 'WEBP' and not features.check('webp'):
+        return 'JPEG'
+    return image_format
+
+
+def get_derivative_names(name):
+    # Производные изображения лежат рядом с оригиналом:
+    # recipes/images/photo.jpg -> recipes/images/photo.card.webp
+    root, _ = os.path.splitext(name)
+    extension = EXTENSIONS[get_derivative_format()]
+    return {size: f'{root}.{size}.{extension}'
+            for size in settings.RECIPE_IMAGE_DERIVATIVES}
+
+
+def render_derivative(image, size, image_format):
+    image = image.copy()
+    image.thumbnail(size, Image.LANCZOS)
+    if image_format == 'JPEG' or image.mode not in ('RGB', 'RGBA'):
+        has_alpha = (image.mode in ('RGBA', 'LA', 'PA')
+                     or 'transparency' in image.info)
+        image = image.convert(
+            'RGBA' if has_alpha and image_format != 'JPEG' else 'RGB')
+    output = io.BytesIO()
+    image.save(output, image_format,
+               quality=settings.RECIPE_IMAGE_QUALITY, optimize=True)
+    return output.getvalue()
+
+
+def create_derivatives(image_file):
+    # Возвращает имена созданных копий по размерам, при ошибке — {}.
+    storage = image_file.storage
+    try:
+        with storage.open(image_file.name, 'rb') as original:
+            image = Image.open(original)
+            image.load()
+    except (OSError, UnidentifiedImageError):
+        logger.exception('Не удалось открыть изображение %s', image_file.name)
+        return {}
+    image = ImageOps.exif_transpose(image)
+    image_format = get_derivative_format()
+    names = get_derivative_names(image_file.name)
+    for size, name in names.items():
+        content = render_derivative(
+            image, settings.RECIPE_IMAGE_DERIVATIVES[size], image_format)
+        # Копии называются по имени оригинала, поэтому записываются под
+        # точным именем, а не через save() с адресацией по содержимому.
+        with storage.open(name, 'wb') as derivative:
+            derivative.write(content)
+    return names
+
+
+def has_derivatives(image_file):
+    return all(image_file.storage.exists(name)
+               for name in get_derivative_names(image_file.name).values())
+
+
+def ensure_derivatives(image_file, force=False):
+    # Такое же изображение уже может быть у другого рецепта вместе
+    # с копиями.
+    if not force and has_derivatives(image_file):
+        return get_derivative_names(image_file.name)
+    return create_derivatives(image_file)
+
+
+def record_derivatives(name, derivatives):
+    # API отдаёт ссылки на копии по этому полю, не проверяя файлы
+    # в хранилище при каждой сериализации рецепта.
+    Recipe.objects.filter(image=name).update(image_derivatives=derivatives)
+
+
+def delete_derivatives(storage, name):
+    for derivative in get_derivative_names(name).values():
+        storage.delete(derivative)
+
+
+def get_original_root(name):
+    # recipes/images/photo.card.webp -> recipes/images/photo,
+    # для оригиналов возвращает None.
+    root, extension = os.path.splitext(name)
+    root, size = os.path.splitext(root)
+    if (size[1:] in settings.RECIPE_IMAGE_DERIVATIVES
+            and extension[1:] in EXTENSIONS.values()):
+        return root
+    return None
+
+
+def release_image(storage, name):
+    # Одинаковые изображения хранятся одним файлом, поэтому файл и его
+    # копии удаляются, только когда на него не ссылается ни один рецепт.
+    # Под той же блокировкой ContentAddressedStorage.save отдаёт
+    # существующий файл, так что незафиксированная ссылка дождётся
+    # удаления и запишет файл заново, а удаление дождётся её фиксации.
+    if not name:
+        return
+    with transaction.atomic():
+        storage.lock(name)
+        if Recipe.objects.filter(image=name).exists():
+            return
+        storage.delete(name)
+        delete_derivatives(storage, name)
+
+
+def queue_recipe_image(recipe, upload):
+    # В запросе загруженный файл только сохраняется как есть, проверка
+    # и обработка изображения выполняются воркером
+    # process_recipe_image_jobs.
+    with upload:
+        RecipeImageJob.objects.create(recipe=recipe, upload=upload)
+    Recipe.objects.filter(pk=recipe.pk).update(
+        image_status=Recipe.IMAGE_PENDING)
+    recipe.image_status = Recipe.IMAGE_PENDING
+
+
+def take_recipe_image_job():
+    # Задачи, зависшие в RUNNING дольше RECIPE_IMAGE_JOB_TIMEOUT, остались
+    # от упавшего воркера и берутся повторно.
+    stale = timezone.now() - timedelta(
+        seconds=settings.RECIPE_IMAGE_JOB_TIMEOUT)
+    with transaction.atomic():
+        job = RecipeImageJob.objects.select_for_update(
+            skip_locked=True,
+        ).filter(
+            Q(status=RecipeImageJob.PENDING)
+            | Q(status=RecipeImageJob.RUNNING, started__lt=stale),
+        ).first()
+        if job is None:
+            return None
+        job.status = RecipeImageJob.RUNNING
+        job.started = timezone.now()
+        job.save(update_fields=['status', 'started'])
+    return job
+
+
+def run_recipe_image_job(job):
+    try:
+        recipe = Recipe.objects.filter(pk=job.recipe_id).first()
+        # Рецепт удалён или для него уже загружено новое изображение.
+        superseded = recipe is None or RecipeImageJob.objects.filter(
+            recipe_id=job.recipe_id, created__gt=job.created).exists()
+        if not superseded:
+            save_recipe_image(job, recipe)
+        job.status = RecipeImageJob.DONE
+    except Exception:
+        # Воркер не должен останавливаться из-за одного изображения.
+        logger.exception('Не удалось обработать изображение %s', job.pk)
+        job.status = RecipeImageJob.FAILED
+        Recipe.objects.filter(pk=job.recipe_id).update(
+            image_status=Recipe.IMAGE_FAILED)
+    job.upload.delete(save=False)
+    # Строки задачи уже может не быть, если рецепт удалили каскадом.
+    jobs = RecipeImageJob.objects.filter(pk=job.pk)
+    if job.status == RecipeImageJob.DONE:
+        jobs.delete()
+    else:
+        jobs.update(status=job.status, upload='')
+
+
+def save_recipe_image(job, recipe):
+    with job.upload.open('rb') as upload:
+        image = Image.open(upload)
+        image.verify()
+        image_format = image.format
+    if image_format not in EXTENSIONS:
+        raise ValueError(f'Неподдерживаемый формат {image_format}')
+    try:
+        # Файл и ссылка на него сохраняются в одной транзакции, чтобы
+        # блокировка хранилища защищала файл до фиксации ссылки.
+        with transaction.atomic():
+            with job.upload.open('rb') as upload:
+                recipe.image.save(
+                    f'{uuid.uuid4().hex}.{EXTENSIONS[image_format]}',
+                    File(upload), save=False)
+            recipe.image_status = Recipe.IMAGE_READY
+            # Уменьшенные копии создаёт обработчик post_save рецепта.
+            recipe.save(update_fields=['image', 'image_status'])
+    except DatabaseError:
+        if Recipe.objects.filter(pk=recipe.pk).exists():
+            raise
+        # Рецепт удалён во время обработки, сохранённый файл не нужен.
+        release_image(recipe.image.storage, recipe.image.name)
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from api.images import ensure_derivatives, record_derivatives
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = ('Создаёт недостающие уменьшенные копии изображений рецептов '
+            'из recipes/images/ и записывает их в рецепты.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help='Пересоздать копии, даже если они есть')
+
+    def handle(self, *args, **options):
+        created = failed = 0
+        names = Recipe.objects.exclude(image='').exclude(
+            image__isnull=True).values_list('image', flat=True).distinct()
+        image_field = Recipe._meta.get_field('image')
+        for name in names.iterator():
+            image = image_field.attr_class(None, image_field, name)
+            derivatives = ensure_derivatives(image, force=options['force'])
+            # Копии записываются и для уже существующих файлов: рецепты,
+            # сохранённые до появления поля, его ещё не заполнили.
+            record_derivatives(name, derivatives)
+            if derivatives:
+                created += 1
+            else:
+                failed += 1
+        self.stdout.write(
+            f'Обработано изображений: {created}, с ошибками: {failed}')
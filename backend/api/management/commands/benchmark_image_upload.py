@@ -0,0 +1,60 @@
+import base64
+import io
+import os
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from drf_extra_fields.fields import Base64ImageField
+from PIL import Image
+
+from api.serializers import ImageUploadField
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает пиковое потребление памяти и время декодирования '
+            'base64-изображения полем Base64ImageField и потоковым полем '
+            'ImageUploadField. Сама строка запроса в замер не входит.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=float, nargs='+',
+                            default=[0.5, 2, 8],
+                            help='Размеры изображений в мегабайтах')
+
+    def handle(self, *args, **options):
+        fields = (
+            ('Base64ImageField', Base64ImageField()),
+            ('ImageUploadField', ImageUploadField()),
+        )
+        self.stdout.write(f'{"размер, МБ":>10} {"поле":>18} '
+                          f'{"пик, МБ":>9} {"время, мс":>10}')
+        for size in options['sizes']:
+            payload = self.make_payload(int(size * 1024 * 1024))
+            for name, field in fields:
+                peak, duration = self.measure(field, payload)
+                self.stdout.write(f'{size:>10} {name:>18} '
+                                  f'{peak / 1024 / 1024:>9.2f} '
+                                  f'{duration * 1000:>10.1f}')
+
+    def make_payload(self, size):
+        # Шум почти не сжимается, поэтому PNG получается размером
+        # около трёх байт на пиксель.
+        side = int((size / 3) ** 0.5)
+        image = Image.frombytes('RGB', (side, side),
+                                os.urandom(side * side * 3))
+        output = io.BytesIO()
+        image.save(output, 'PNG')
+        return ('data:image/png;base64,'
+                + base64.b64encode(output.getvalue()).decode())
+
+    def measure(self, field, payload):
+        with override_settings(RECIPE_IMAGE_MAX_SIZE=len(payload)):
+            tracemalloc.start()
+            started = time.perf_counter()
+            value = field.to_internal_value(payload)
+            duration = time.perf_counter() - started
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        value.close()
+        return peak, duration
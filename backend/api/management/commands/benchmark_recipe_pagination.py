@@ -0,0 +1,81 @@
+import time
+import uuid
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from rest_framework.test import APIRequestFactory
+
+from api.paginations import PubDateCursorPagination
+from api.views import RecipeViewSet
+from recipes.models import Recipe
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает время ответа /api/recipes/ при постраничной и '
+            'курсорной пагинации на глубоких страницах. Тестовые данные '
+            'создаются в транзакции и откатываются.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, nargs='+',
+                            default=[1, 10, 100, 1000, 10000],
+                            help='Номера страниц для замера')
+        parser.add_argument('--limit', type=int, default=6,
+                            help='Размер страницы')
+        parser.add_argument('--repeat', type=int, default=10,
+                            help='Количество запросов на каждый замер')
+
+    def handle(self, *args, **options):
+        limit = options['limit']
+        with transaction.atomic():
+            self.seed(max(options['pages']) * limit)
+            view = RecipeViewSet.as_view({'get': 'list'})
+            factory = APIRequestFactory(SERVER_NAME=settings.ALLOWED_HOSTS[0])
+            self.stdout.write(f'{"страница":>10} {"page, мс":>10} '
+                              f'{"cursor, мс":>12}')
+            for page in options['pages']:
+                page_url = f'/api/recipes/?limit={limit}&page={page}'
+                cursor_url = (f'/api/recipes/?limit={limit}&pagination=cursor'
+                              f'{self.get_cursor(page, limit)}')
+                page_time = self.measure(view, factory, page_url, options)
+                cursor_time = self.measure(view, factory, cursor_url, options)
+                self.stdout.write(
+                    f'{page:>10} {page_time:>10.2f} {cursor_time:>12.2f}')
+            transaction.set_rollback(True)
+
+    def seed(self, count):
+        author = User.objects.create(
+            username=f'benchmark_{uuid.uuid4().hex[:8]}',
+            email=f'{uuid.uuid4().hex}@benchmark.local',
+        )
+        Recipe.objects.bulk_create(
+            (Recipe(name=f'benchmark {i}', text='benchmark', author=author,
+                    cooking_time=1)
+             for i in range(count)),
+            batch_size=5000,
+        )
+        # auto_now_add выставляет всем рецептам почти одинаковое время,
+        # поэтому даты публикации разносятся по минутам.
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'UPDATE recipes_recipe '
+                "SET pub_date = now() - id * interval '1 minute' "
+                'WHERE author_id = %s', [author.pk])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE recipes_recipe')
+
+    def get_cursor(self, page, limit):
+        if page == 1:
+            return ''
+        previous = Recipe.objects.order_by(
+            '-pub_date', '-id')[(page - 1) * limit - 1]
+        return f'&cursor={PubDateCursorPagination().encode_cursor(previous)}'
+
+    def measure(self, view, factory, url, options):
+        started = time.perf_counter()
+        for _ in range(options['repeat']):
+            response = view(factory.get(url))
+            response.render()
+            assert response.status_code == 200, response.data
+        return (time.perf_counter() - started) / options['repeat'] * 1000
@@ -0,0 +1,67 @@
+import io
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.utils import get_shopping_cart_ingredients, render_shopping_list
+from recipes.models import Ingredient, IngredientSpecification, Recipe
+from users.models import User
+
+FORMATS = ('pdf', 'txt', 'csv', 'json')
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает скорость выгрузки списка покупок в разных форматах. '
+            'Тестовые данные создаются в транзакции и откатываются.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+',
+                            default=[10, 100, 1000],
+                            help='Количество разных ингредиентов в корзине')
+        parser.add_argument('--repeat', type=int, default=20,
+                            help='Количество выгрузок на каждый замер')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            user = User.objects.create(
+                username=f'benchmark_{uuid.uuid4().hex[:8]}',
+                email=f'{uuid.uuid4().hex}@benchmark.local',
+            )
+            self.stdout.write(f'{"ингредиентов":>12} {"формат":>6} '
+                              f'{"док/с":>10} {"мс/док":>10} {"байт":>10}')
+            for size in options['sizes']:
+                self.fill_shopping_cart(user, size)
+                for file_format in FORMATS:
+                    self.measure(user, size, file_format, options['repeat'])
+            transaction.set_rollback(True)
+
+    def fill_shopping_cart(self, user, size):
+        prefix = uuid.uuid4().hex[:8]
+        specifications = IngredientSpecification.objects.bulk_create(
+            IngredientSpecification(name=f'{prefix} ингредиент {i}',
+                                    measurement_unit='г')
+            for i in range(size)
+        )
+        recipe = Recipe.objects.create(
+            name=f'benchmark {size}', text='benchmark', author=user,
+            cooking_time=1)
+        Ingredient.objects.bulk_create(
+            Ingredient(recipe=recipe, specification=specification, amount=1)
+            for specification in specifications
+        )
+        user.shopping_cart.set([recipe])
+
+    def measure(self, user, size, file_format, repeat):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            output = io.BytesIO()
+            render_shopping_list(
+                get_shopping_cart_ingredients(user).iterator(),
+                file_format, output)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f'{size:>12} {file_format:>6} {repeat / elapsed:>10.1f} '
+            f'{elapsed / repeat * 1000:>10.2f} '
+            f'{len(output.getvalue()):>10}')
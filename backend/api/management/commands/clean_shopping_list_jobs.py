@@ -0,0 +1,24 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from recipes.models import ShoppingListJob
+
+
+class Command(BaseCommand):
+    help = ('Удаляет асинхронные выгрузки списков покупок старше '
+            'SHOPPING_LIST_JOB_TTL секунд вместе с файлами.')
+
+    def handle(self, *args, **options):
+        expired = ShoppingListJob.objects.filter(
+            created__lt=timezone.now() - timedelta(
+                seconds=settings.SHOPPING_LIST_JOB_TTL),
+        )
+        deleted = 0
+        for job in expired.iterator():
+            # Файл удаляет обработчик post_delete выгрузки.
+            job.delete()
+            deleted += 1
+        self.stdout.write(f'Удалено выгрузок: {deleted}')
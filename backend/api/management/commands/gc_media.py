@@ -0,0 +1,116 @@
+import os
+import time
+from functools import reduce
+from itertools import islice
+from operator import or_
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from api.images import get_original_root, release_image
+from recipes.models import Recipe, RecipeImageJob
+
+
+class Command(BaseCommand):
+    help = ('Удаляет из recipes/images/ файлы, на которые не ссылается ни '
+            'один рецепт, вместе с уменьшенными копиями, а из '
+            'recipes/uploads/ — загрузки без задачи обработки. Каталоги '
+            'читаются потоком, ссылки проверяются пачками.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только показать файлы без ссылок')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Количество файлов на один запрос к базе')
+        parser.add_argument('--min-age', type=int, default=3600,
+                            help='Не трогать файлы моложе стольких секунд: '
+                                 'их рецепты могут быть ещё не сохранены')
+
+    def handle(self, *args, **options):
+        modified_before = time.time() - options['min_age']
+        # Изображения удаляются через release_image, которая перепроверяет
+        # ссылки под блокировкой ContentAddressedStorage.
+        sweeps = (
+            (Recipe._meta.get_field('image'), self.get_orphan_images,
+             release_image),
+            (RecipeImageJob._meta.get_field('upload'),
+             self.get_orphan_uploads, self.delete_file),
+        )
+        count = size = 0
+        for field, get_orphans, delete in sweeps:
+            storage = field.storage
+            files = self.scan(storage, field.upload_to, modified_before)
+            while True:
+                batch = dict(islice(files, options['batch_size']))
+                if not batch:
+                    break
+                for name in get_orphans(batch):
+                    count += 1
+                    size += batch[name]
+                    if options['verbosity'] > 1:
+                        self.stdout.write(name)
+                    if not options['dry_run']:
+                        delete(storage, name)
+        action = 'Найдено' if options['dry_run'] else 'Удалено'
+        self.stdout.write(f'{action}. Файлов без ссылок: {count}, '
+                          f'объём: {size} байт')
+
+    def scan(self, storage, directory, modified_before):
+        # os.scandir, в отличие от storage.listdir, не собирает содержимое
+        # каталога в список целиком.
+        directories = [storage.path(directory)]
+        while directories:
+            path = directories.pop()
+            if not os.path.isdir(path):
+                continue
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        directories.append(entry.path)
+                        continue
+                    try:
+                        stat = entry.stat(follow_symlinks=False)
+                    except FileNotFoundError:
+                        # Уже удалён вместе с оригиналом.
+                        continue
+                    if stat.st_mtime > modified_before:
+                        continue
+                    name = os.path.relpath(entry.path, storage.location)
+                    yield name.replace(os.sep, '/'), stat.st_size
+
+    def delete_file(self, storage, name):
+        storage.delete(name)
+
+    def get_orphan_uploads(self, names):
+        referenced = set(RecipeImageJob.objects.filter(
+            upload__in=names).values_list('upload', flat=True))
+        for name in names:
+            if name not in referenced:
+                yield name
+
+    def get_orphan_images(self, names):
+        originals = []
+        derivatives = {}
+        for name in names:
+            root = get_original_root(name)
+            if root is None:
+                originals.append(name)
+            else:
+                derivatives[name] = root
+        referenced = set(Recipe.objects.filter(
+            image__in=originals).values_list('image', flat=True))
+        referenced_roots = set()
+        if derivatives:
+            query = reduce(or_, (Q(image__startswith=f'{root}.')
+                                 for root in set(derivatives.values())))
+            referenced_roots = {
+                os.path.splitext(name)[0]
+                for name in Recipe.objects.filter(query).values_list(
+                    'image', flat=True)
+            }
+        for name in originals:
+            if name not in referenced:
+                yield name
+        for name, root in derivatives.items():
+            if root not in referenced_roots:
+                yield name
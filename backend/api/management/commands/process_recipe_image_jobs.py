@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.images import run_recipe_image_job, take_recipe_image_job
+
+
+class Command(BaseCommand):
+    help = ('Проверяет и обрабатывает изображения рецептов, загруженные '
+            'через API.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Обработать очередь и завершиться')
+        parser.add_argument('--interval', type=float, default=1,
+                            help='Пауза между проверками очереди, секунд')
+
+    def handle(self, *args, **options):
+        while True:
+            job = take_recipe_image_job()
+            if job is not None:
+                run_recipe_image_job(job)
+                continue
+            if options['once']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.shopping_lists import run_shopping_list_job, take_shopping_list_job
+
+
+class Command(BaseCommand):
+    help = 'Формирует списки покупок, заказанные в асинхронном режиме.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Обработать очередь и завершиться')
+        parser.add_argument('--interval', type=float, default=1,
+                            help='Пауза между проверками очереди, секунд')
+
+    def handle(self, *args, **options):
+        while True:
+            job = take_shopping_list_job()
+            if job is not None:
+                run_shopping_list_job(job)
+                continue
+            if options['once']:
+                return
+            time.sleep(options['interval'])
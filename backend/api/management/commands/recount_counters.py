@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.counters import recount_counters
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает денормализованные счётчики избранного, рецептов '
+            'и подписчиков и исправляет расхождения.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            fixed = recount_counters()
+        for counter, count in fixed.items():
+            self.stdout.write(f'{counter}: исправлено записей {count}')
@@ -1,6 +1,186 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import binascii
+import hashlib
+import json
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
+from django.db import connection
+from django.db.models import Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (BasePagination, CursorPagination,
+                                       PageNumberPagination)
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+COUNT_VERSION_CACHE_KEY = 'count_version_{}'
+
+
+def positive_int(value, strict=False):
+    # Разбирает неотрицательное целое из параметра запроса, при strict
+    # ноль тоже считается ошибкой.
+    number = int(value)
+    if number < 0 or (strict and number == 0):
+        raise ValueError(value)
+    return number
+
+
+def invalidate_counts(table):
+    key = COUNT_VERSION_CACHE_KEY.format(table)
+    cache.add(key, 0, timeout=None)
+    cache.incr(key)
+
+
+class CachedCountPaginator(Paginator):
+    # Количество объектов кэшируется по SQL-запросу с учётом версий
+    # задействованных таблиц, а для больших выборок берётся оценка
+    # планировщика PostgreSQL вместо COUNT(*).
+    @cached_property
+    def count(self):
+        return self.counted[0]
+
+    @property
+    def count_is_exact(self):
+        return self.counted[1]
+
+    @cached_property
+    def counted(self):
+        try:
+            query = self.object_list.order_by().values('pk').query
+            sql, params = query.sql_with_params()
+        except (AttributeError, EmptyResultSet):
+            return super().count, True
+        tables = sorted({alias.table_name
+                         for alias in query.alias_map.values()})
+        versions = cache.get_many(
+            [COUNT_VERSION_CACHE_KEY.format(table) for table in tables])
+        key = 'pagination_count_{}'.format(hashlib.md5(json.dumps(
+            [sql, [str(param) for param in params], sorted(versions.items())]
+        ).encode()).hexdigest())
+        cached = cache.get(key)
+        if cached is None:
+            cached = self.estimate_count(query, sql, params)
+            cache.set(key, cached, settings.PAGINATION_COUNT_CACHE_TIMEOUT)
+        return cached
+
+    def estimate_count(self, query, sql, params):
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                if query.where:
+                    cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+                    plan = cursor.fetchone()[0]
+                    if isinstance(plan, str):
+                        plan = json.loads(plan)
+                    estimate = plan[0]['Plan']['Plan Rows']
+                else:
+                    cursor.execute(
+                        'SELECT reltuples FROM pg_class '
+                        'WHERE oid = %s::regclass',
+                        [self.object_list.model._meta.db_table])
+                    estimate = cursor.fetchone()[0]
+            if (estimate > 0 and estimate
+                    >= settings.PAGINATION_COUNT_ESTIMATE_THRESHOLD):
+                return int(estimate), False
+        return super().count, True
+
+    def validate_number(self, number):
+        if self.count_is_exact:
+            return super().validate_number(number)
+        # Оценка может быть меньше реального количества, поэтому верхнюю
+        # границу номера страницы не проверяем.
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger('That page number is not an integer')
+        if number < 1:
+            raise EmptyPage('That page number is less than 1')
+        return number
+
+    def page(self, number):
+        if self.count_is_exact:
+            return super().page(number)
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        return self._get_page(
+            self.object_list[bottom:bottom + self.per_page], number, self)
 
 
 class LimitPageNumberPagination(PageNumberPagination):
+    django_paginator_class = CachedCountPaginator
+    page_size_query_param = 'limit'
+    page_size = 6
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        response.data['count_is_exact'] = self.page.paginator.count_is_exact
+        return response
+
+
+class PubDateCursorPagination(BasePagination):
+    # Постраничный вывод по ключу (pub_date, id): следующая страница
+    # начинается сразу за последней записью предыдущей, без OFFSET и COUNT.
+    cursor_query_param = 'cursor'
     page_size_query_param = 'limit'
     page_size = 6
+    invalid_cursor_message = CursorPagination.invalid_cursor_message
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        queryset = queryset.order_by('-pub_date', '-id')
+        position = self.decode_cursor(request)
+        if position is not None:
+            pub_date, pk = position
+            # Условие pub_date <= d задаёт границу сканирования индекса
+            # (pub_date, id), без неё Postgres не может использовать
+            # индекс для OR и отбрасывает фильтром все предыдущие строки.
+            queryset = queryset.filter(pub_date__lte=pub_date).filter(
+                Q(pub_date__lt=pub_date) | Q(id__lt=pk))
+        results = list(queryset[:self.page_size + 1])
+        self.has_next = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            return positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True,
+            )
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            pub_date, pk = base64.urlsafe_b64decode(
+                encoded.encode()).decode().split('|')
+            return datetime.fromisoformat(pub_date), int(pk)
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, instance):
+        cursor = f'{instance.pub_date.isoformat()}|{instance.pk}'
+        return base64.urlsafe_b64encode(cursor.encode()).decode()
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            self.encode_cursor(self.page[-1]),
+        )
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
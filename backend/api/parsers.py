@@ -0,0 +1,25 @@
+import json
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import DataAndFiles, MultiPartParser
+
+
+class MultiPartJSONParser(MultiPartParser):
+    # Файлы передаются отдельными частями и сохраняются обработчиками
+    # загрузки Django, остальные поля — JSON-объектом в части data.
+    # Так вложенные ingredients и tags не приходится кодировать в форме.
+    data_field = 'data'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parsed = super().parse(stream, media_type, parser_context)
+        try:
+            data = json.loads(parsed.data.get(self.data_field, '{}'))
+        except ValueError as exc:
+            raise ParseError(f'JSON parse error - {exc}')
+        if not isinstance(data, dict):
+            raise ParseError(f'Поле {self.data_field} должно содержать '
+                             f'JSON-объект.')
+        # request.data дополняется файлами через dict.update, которое для
+        # MultiValueDict подставило бы списки, поэтому файлы передаются
+        # обычным словарём.
+        return DataAndFiles(data, parsed.files.dict())
@@ -0,0 +1,114 @@
+from django.db import connection, transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+
+
+def get_columns(model, fields):
+    return [connection.ops.quote_name(model._meta.get_field(name).column)
+            for name in fields]
+
+
+def create_relation(model, **fields):
+    # Связь создаётся одним INSERT ... ON CONFLICT DO NOTHING, повторный
+    # или параллельный запрос не вставляет строку и получает False.
+    # Сигналы отправляются вручную, чтобы обновились счётчики и кэши.
+    columns = get_columns(model, fields)
+    sql = 'INSERT INTO {} ({}) VALUES ({}) ON CONFLICT DO NOTHING RETURNING {}'
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(sql.format(
+            connection.ops.quote_name(model._meta.db_table),
+            ', '.join(columns),
+            ', '.join(['%s'] * len(columns)),
+            connection.ops.quote_name(model._meta.pk.column),
+        ), list(fields.values()))
+        row = cursor.fetchone()
+        if row is None:
+            return False
+        post_save.send(
+            sender=model, instance=model(pk=row[0], **fields), created=True,
+            update_fields=None, raw=False, using=connection.alias)
+    return True
+
+
+def delete_relation(model, **fields):
+    # Удаление одним DELETE ... RETURNING: сигнал post_delete получает
+    # только тот запрос, который действительно удалил строку.
+    columns = get_columns(model, fields)
+    sql = 'DELETE FROM {} WHERE {} RETURNING {}'
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(sql.format(
+            connection.ops.quote_name(model._meta.db_table),
+            ' AND '.join(f'{column} = %s' for column in columns),
+            connection.ops.quote_name(model._meta.pk.column),
+        ), list(fields.values()))
+        row = cursor.fetchone()
+        if row is None:
+            return False
+        post_delete.send(
+            sender=model, instance=model(pk=row[0], **fields),
+            using=connection.alias)
+    return True
+
+
+def get_relation_fields(relation):
+    # relation — дескриптор связи многие-ко-многим со стороны владельца,
+    # например User.favorite_recipes или User.following.
+    field = relation.field
+    if relation.reverse:
+        return (field.m2m_reverse_field_name(), field.m2m_field_name(),
+                field.model)
+    return (field.m2m_field_name(), field.m2m_reverse_field_name(),
+            field.related_model)
+
+
+def create_relations(relation, instance, pks):
+    # Аналог instance.<relation>.add(*pks) одним
+    # INSERT ... ON CONFLICT DO NOTHING, возвращает вставленные ключи.
+    if not pks:
+        return set()
+    through = relation.through
+    owner_field, target_field, target_model = get_relation_fields(relation)
+    owner_column, target_column = get_columns(
+        through, [owner_field, target_field])
+    sql = ('INSERT INTO {} ({}, {}) SELECT %s, UNNEST(%s) '
+           'ON CONFLICT DO NOTHING RETURNING {}')
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(sql.format(
+            connection.ops.quote_name(through._meta.db_table),
+            owner_column, target_column, target_column,
+        ), [instance.pk, list(pks)])
+        created = {row[0] for row in cursor.fetchall()}
+        if created:
+            m2m_changed.send(
+                sender=through, instance=instance, action='post_add',
+                reverse=relation.reverse, model=target_model,
+                pk_set=created, using=connection.alias)
+    return created
+
+
+def delete_relations(relation, instance, pks):
+    # Аналог instance.<relation>.remove(*pks) одним DELETE ... RETURNING,
+    # возвращает ключи удалённых связей.
+    if not pks:
+        return set()
+    through = relation.through
+    owner_field, target_field, _ = get_relation_fields(relation)
+    owner_column, target_column = get_columns(
+        through, [owner_field, target_field])
+    sql = 'DELETE FROM {} WHERE {} = %s AND {} = ANY(%s) RETURNING {}, {}'
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(sql.format(
+            connection.ops.quote_name(through._meta.db_table),
+            owner_column, target_column,
+            connection.ops.quote_name(through._meta.pk.column),
+            target_column,
+        ), [instance.pk, list(pks)])
+        deleted = set()
+        for pk, target_pk in cursor.fetchall():
+            deleted.add(target_pk)
+            post_delete.send(
+                sender=through, using=connection.alias,
+                instance=through(pk=pk, **{
+                    through._meta.get_field(owner_field).attname: instance.pk,
+                    through._meta.get_field(target_field).attname: target_pk,
+                }))
+    return deleted
@@ -0,0 +1,45 @@
+from rest_framework.renderers import BaseRenderer
+
+
+class ShoppingListRenderer(BaseRenderer):
+    # Списки покупок отдаются готовыми файлами, рендереры нужны только
+    # для выбора формата по ?format= и заголовку Accept.
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return b''
+
+
+class PDFRenderer(ShoppingListRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+
+
+class PlainTextRenderer(ShoppingListRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+    charset = 'utf-8'
+
+
+class CSVRenderer(ShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+
+class JSONShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'application/json'
+    format = 'json'
+    charset = 'utf-8'
+
+
+SHOPPING_LIST_RENDERERS = [PDFRenderer, PlainTextRenderer, CSVRenderer,
+                           JSONShoppingListRenderer]
+
+
+def get_shopping_list_content_type(file_format):
+    for renderer in SHOPPING_LIST_RENDERERS:
+        if renderer.format == file_format:
+            if renderer.charset:
+                return f'{renderer.media_type}; charset={renderer.charset}'
+            return renderer.media_type
+    raise ValueError(f'Неизвестный формат списка покупок: {file_format}')
@@ -0,0 +1,88 @@
+import bisect
+import threading
+import time
+
+from django.conf import settings
+from django.db.models import Case, IntegerField, Value, When
+
+from api.caches import bump_version, get_version
+from api.serializers import IngredientSpecificationSerializer
+from recipes.models import IngredientSpecification
+
+INDEX_VERSION_CACHE_KEY = 'ingredient_index_version'
+# Символ больше любого другого: все ключи с префиксом term лежат
+# в отсортированном массиве на отрезке [term, term + PREFIX_END).
+PREFIX_END = '\U0010ffff'
+
+_index = None
+_index_lock = threading.Lock()
+
+
+class IngredientIndex:
+    def __init__(self, records, version):
+        records = sorted(records, key=lambda record: record['name'].casefold())
+        self.keys = tuple(record['name'].casefold() for record in records)
+        self.records = tuple(records)
+        self.version = version
+        self.built = time.monotonic()
+
+    def is_fresh(self, version):
+        # Записи, добавленные в обход сигналов (например,
+        # data/csv_to_database.py), попадут в индекс не позже чем через
+        # INGREDIENT_INDEX_TIMEOUT секунд.
+        return (self.version == version
+                and time.monotonic() - self.built
+                < settings.INGREDIENT_INDEX_TIMEOUT)
+
+    def search(self, term):
+        term = term.casefold()
+        start = bisect.bisect_left(self.keys, term)
+        end = bisect.bisect_left(self.keys, term + PREFIX_END, lo=start)
+        result = list(self.records[start:end])
+        result.extend(
+            self.records[position]
+            for position, key in enumerate(self.keys)
+            if (position < start or position >= end) and term in key
+        )
+        return result
+
+
+def get_ingredient_index():
+    global _index
+    version = get_version(INDEX_VERSION_CACHE_KEY)
+    index = _index
+    if index is not None and index.is_fresh(version):
+        return index
+    with _index_lock:
+        if _index is None or not _index.is_fresh(version):
+            _index = IngredientIndex(
+                IngredientSpecificationSerializer(
+                    IngredientSpecification.objects.all(), many=True).data,
+                version,
+            )
+        return _index
+
+
+def invalidate_ingredient_index():
+    global _index
+    _index = None
+    bump_version(INDEX_VERSION_CACHE_KEY)
+
+
+def trigram_search(term):
+    queryset = IngredientSpecification.objects.filter(
+        name__icontains=term,
+    ).annotate(
+        starts_with=Case(
+            When(name__istartswith=term, then=Value(0)),
+            default=Value(1),
+            output_field=IntegerField(),
+        ),
+    ).order_by('starts_with', 'name')[:settings.INGREDIENT_SEARCH_LIMIT]
+    return IngredientSpecificationSerializer(queryset, many=True).data
+
+
+def search_ingredients(term):
+    if settings.INGREDIENT_SEARCH_BACKEND == 'trigram':
+        return trigram_search(term)
+    return get_ingredient_index().search(term)
@@ -1,13 +1,71 @@
+import base64
+import binascii
+import tempfile
+import uuid
+
+from django.conf import settings
 from django.contrib.auth.password_validation import validate_password
-from django.db.models import F
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.files import File
+from django.core.files.uploadedfile import UploadedFile
+from django.db import transaction
+from django.db.models import (F, Model, Prefetch, Window,
+                              prefetch_related_objects)
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import RowNumber
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
 from rest_framework.fields import SerializerMethodField
 
-from recipes.models import Ingredient, IngredientSpecification, Recipe, Tag
+from api.images import EXTENSIONS, queue_recipe_image, sniff_image_format
+from api.paginations import positive_int
+from api.shopping_lists import invalidate_shopping_carts
+from recipes.models import (Ingredient, IngredientSpecification, Recipe, Tag,
+                            TagRecipe)
 from users.models import User
 
 
+def is_subscribed(serializer, author):
+    # Подписки текущего пользователя на авторов со всей страницы
+    # загружаются одним запросом и кешируются в контексте сериализатора.
+    user = serializer.context['request'].user
+    if not user.is_authenticated:
+        return False
+    if 'subscriptions' not in serializer.context:
+        instances = serializer.root.instance
+        if isinstance(instances, Model):
+            instances = [instances]
+        authors_ids = {getattr(instance, 'author_id', instance.pk)
+                       for instance in instances}
+        serializer.context['subscriptions'] = set(
+            user.following_set.filter(
+                following__in=authors_ids,
+            ).values_list('following_id', flat=True))
+    return author.pk in serializer.context['subscriptions']
+
+
+class ImageDerivativesField(serializers.Field):
+    # Ссылки на уменьшенные копии изображения рецепта по размерам из поля
+    # image_derivatives. Несозданные копии (ошибка обработки или старое
+    # изображение до backfill_recipe_images) не отдаются, чтобы не вести
+    # на 404.
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        kwargs.setdefault('source', 'image_derivatives')
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        storage = Recipe._meta.get_field('image').storage
+        request = self.context.get('request')
+        urls = {}
+        for size in settings.RECIPE_IMAGE_DERIVATIVES:
+            if size not in value:
+                continue
+            url = storage.url(value[size])
+            urls[size] = request.build_absolute_uri(url) if request else url
+        return urls or None
+
+
 class UserSerializer(serializers.ModelSerializer):
     is_subscribed = SerializerMethodField(method_name='is_subscribed_by_user')
 
@@ -18,11 +76,7 @@ class UserSerializer(serializers.ModelSerializer):
             'last_name', 'id', 'is_subscribed')
 
     def is_subscribed_by_user(self, instance):
-        try:
-            return (self.context['request'].user.following.filter(
-                username=instance).exists())
-        except Exception:
-            return False
+        return is_subscribed(self, instance)
 
 
 class IngredientSpecificationSerializer(serializers.ModelSerializer):
@@ -39,6 +93,7 @@ class TagSerializer(serializers.ModelSerializer):
 
 class RecipeSerializer(serializers.ModelSerializer):
     image = Base64ImageField(max_length=None)
+    images = ImageDerivativesField()
     author = UserSerializer(read_only=True)
     tags = TagSerializer(many=True, read_only=True)
     ingredients = SerializerMethodField()
@@ -49,33 +104,164 @@ class RecipeSerializer(serializers.ModelSerializer):
         model = Recipe
         fields = [
             'id', 'tags', 'author', 'ingredients',
-            'name', 'image', 'text', 'cooking_time',
-            'is_favorited', 'is_in_shopping_cart',
+            'name', 'image', 'images', 'image_status', 'text',
+            'cooking_time', 'is_favorited', 'is_in_shopping_cart',
         ]
 
-    def get_ingredients(self, instance):
-        ingredients = instance.ingredients.values(
-            "id", "name", "measurement_unit", amount=F("ingredient__amount")
+    @staticmethod
+    def get_prefetches():
+        return (
+            Prefetch('tags'),
+            Prefetch(
+                'ingredient_set',
+                queryset=Ingredient.objects.select_related(
+                    'specification').order_by('specification__name'),
+            ),
         )
-        return ingredients
+
+    def get_ingredients(self, instance):
+        return [
+            {
+                'id': ingredient.specification.id,
+                'name': ingredient.specification.name,
+                'measurement_unit': ingredient.specification.measurement_unit,
+                'amount': ingredient.amount,
+            }
+            for ingredient in instance.ingredient_set.all()
+        ]
 
     def get_is_favorited(self, instance):
-        try:
-            return (self.context['request'].user.favorite_recipes.filter(
-                id=instance.id).exists())
-        except Exception:
-            return False
+        if hasattr(instance, 'user_favorited'):
+            return instance.user_favorited
+        user = self.context['request'].user
+        return (user.is_authenticated
+                and user.favorite_recipes.filter(id=instance.id).exists())
 
     def get_is_in_shopping_cart(self, instance):
+        if hasattr(instance, 'user_in_shopping_cart'):
+            return instance.user_in_shopping_cart
+        user = self.context['request'].user
+        return (user.is_authenticated
+                and user.shopping_cart.filter(id=instance.id).exists())
+
+
+class LazyPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    # Проверяет только тип ключа. Существование объектов проверяет
+    # сериализатор рецепта одним запросом на все переданные ключи.
+    def to_internal_value(self, data):
+        try:
+            return self.get_queryset().model._meta.pk.to_python(data)
+        except (TypeError, ValueError, DjangoValidationError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+    def does_not_exist_message(self, pk_value):
+        return self.error_messages['does_not_exist'].format(
+            pk_value=pk_value)
+
+
+class ImageUploadField(serializers.Field):
+    # Принимает файл из multipart-запроса или строку base64. Base64
+    # декодируется частями во временный файл: в памяти держится только
+    # текущая часть, а крупные загрузки сбрасываются на диск. Размер и
+    # сигнатура формата проверяются до декодирования всего изображения,
+    # полную проверку Pillow выполняет воркер process_recipe_image_jobs.
+    CHUNK_SIZE = 64 * 1024
+    HEADER_LENGTH = 256
+    WHITESPACE = ' \t\r\n'
+    WHITESPACE_TABLE = str.maketrans('', '', WHITESPACE)
+
+    default_error_messages = {
+        'invalid': 'Ожидается файл изображения или строка в кодировке '
+                   'base64.',
+        'not_an_image': 'Загрузите изображение в формате JPEG, PNG, GIF '
+                        'или WEBP.',
+        'max_size': 'Размер изображения не должен превышать '
+                    '{max_size} байт.',
+    }
+
+    def to_internal_value(self, data):
+        if isinstance(data, UploadedFile):
+            return self.validate_file(data)
+        if not isinstance(data, str):
+            self.fail('invalid')
+        # Префикс data:image/...;base64, ищется только в начале строки,
+        # чтобы не копировать всю полезную нагрузку.
+        start = data.find(';base64,', 0, self.HEADER_LENGTH)
+        start = 0 if start == -1 else start + len(';base64,')
+        # Переводы строк и пробелы допускаются, как и в Base64ImageField;
+        # str.count не копирует строку.
+        whitespace = sum(data.count(char, start) for char in self.WHITESPACE)
+        length = len(data) - start - whitespace
+        if not length:
+            self.fail('invalid')
+        max_size = settings.RECIPE_IMAGE_MAX_SIZE
+        # Без учёта '=' оценка завышена не больше чем на два байта, точный
+        # размер проверяется при декодировании.
+        if length * 3 // 4 - 2 > max_size:
+            self.fail('max_size', max_size=max_size)
+        upload = tempfile.SpooledTemporaryFile(
+            max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
         try:
-            return (self.context['request'].user.shopping_cart.filter(
-                id=instance.id).exists())
-        except Exception:
-            return False
+            image_format = self.decode(data, start, upload, max_size)
+        except BaseException:
+            upload.close()
+            raise
+        upload.seek(0)
+        extension = EXTENSIONS[image_format]
+        return File(upload, name=f'{uuid.uuid4().hex}.{extension}')
+
+    def validate_file(self, upload):
+        # Файл уже сохранён обработчиками загрузки Django, поэтому
+        # проверяются только размер и первые байты.
+        max_size = settings.RECIPE_IMAGE_MAX_SIZE
+        if upload.size > max_size:
+            self.fail('max_size', max_size=max_size)
+        upload.seek(0)
+        image_format = sniff_image_format(upload.read(16))
+        if image_format is None:
+            self.fail('not_an_image')
+        upload.seek(0)
+        upload.name = f'{uuid.uuid4().hex}.{EXTENSIONS[image_format]}'
+        return upload
+
+    def decode(self, data, start, upload, max_size):
+        image_format = None
+        size = 0
+        for part in self.iter_parts(data, start):
+            try:
+                chunk = base64.b64decode(part, validate=True)
+            except (binascii.Error, ValueError):
+                self.fail('invalid')
+            if image_format is None:
+                image_format = sniff_image_format(chunk)
+                if image_format is None:
+                    self.fail('not_an_image')
+            size += len(chunk)
+            if size > max_size:
+                self.fail('max_size', max_size=max_size)
+            upload.write(chunk)
+        return image_format
+
+    def iter_parts(self, data, start):
+        # Части без пробельных символов длиной, кратной четырём; последней
+        # при необходимости дописывается недостающее выравнивание '='.
+        pending = ''
+        for offset in range(start, len(data), self.CHUNK_SIZE):
+            part = pending + data[offset:offset + self.CHUNK_SIZE].translate(
+                self.WHITESPACE_TABLE)
+            cut = len(part) - len(part) % 4
+            pending = part[cut:]
+            if cut:
+                yield part[:cut]
+        if pending:
+            yield pending + '=' * (-len(pending) % 4)
+
+    def to_representation(self, value):
+        return value.url if value else None
 
 
 class IngredientSerializer(serializers.ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(
+    id = LazyPrimaryKeyRelatedField(
         queryset=IngredientSpecification.objects.all(),
     )
     name = serializers.ReadOnlyField(source='specification.name')
@@ -90,9 +276,9 @@ class IngredientSerializer(serializers.ModelSerializer):
 
 class RecipeSerializerPost(serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
-    image = Base64ImageField(max_length=None)
+    image = ImageUploadField()
     ingredients = IngredientSerializer(many=True)
-    tags = serializers.PrimaryKeyRelatedField(
+    tags = LazyPrimaryKeyRelatedField(
         queryset=Tag.objects.all(),
         many=True,
     )
@@ -109,28 +295,55 @@ class RecipeSerializerPost(serializers.ModelSerializer):
                 "Название должно содержать буквы")
         return name
 
-    def validate_tags(self, tags):
-        if not tags:
+    def validate_tags(self, tags_ids):
+        if not tags_ids:
             raise serializers.ValidationError(
                 'Вы не указали ни одного тега')
-        tags_ids = self.initial_data['tags']
-        if sorted(list(set(tags_ids))) != sorted(tags_ids):
+        field = self.fields['tags'].child_relation
+        tags = Tag.objects.in_bulk(tags_ids)
+        errors = []
+        seen = set()
+        duplicated = False
+        for tag_id in tags_ids:
+            if tag_id not in tags:
+                errors.append(field.does_not_exist_message(tag_id))
+            duplicated = duplicated or tag_id in seen
+            seen.add(tag_id)
+        if errors:
+            raise serializers.ValidationError(errors)
+        if duplicated:
             raise serializers.ValidationError(
                 'Вы указали одинаковые теги')
-        return tags
+        return [tags[tag_id] for tag_id in tags_ids]
 
     def validate_ingredients(self, ingredients):
         if not ingredients:
             raise serializers.ValidationError(
                 'Вы не указали ни одного ингредиента')
-        ingredients_data = self.initial_data['ingredients']
-        ingredients_ids = []
-        for ingredient in ingredients_data:
-            ingredients_ids.append(ingredient['id'])
-        if sorted(list(set(ingredients_ids))) != sorted(ingredients_ids):
+        field = self.fields['ingredients'].child.fields['id']
+        specifications = IngredientSpecification.objects.in_bulk(
+            [ingredient['id'] for ingredient in ingredients])
+        errors = []
+        seen = set()
+        duplicated = False
+        for ingredient in ingredients:
+            specification_id = ingredient['id']
+            if specification_id in specifications:
+                errors.append({})
+            else:
+                errors.append({'id': [
+                    field.does_not_exist_message(specification_id)]})
+            duplicated = duplicated or specification_id in seen
+            seen.add(specification_id)
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        if duplicated:
             raise serializers.ValidationError(
                 'Вы указали одинаковые ингредиенты')
-        return ingredients
+        return [
+            {**ingredient, 'id': specifications[ingredient['id']]}
+            for ingredient in ingredients
+        ]
 
     def validate(self, data):
         if 'tags' not in self.initial_data:
@@ -140,39 +353,112 @@ class RecipeSerializerPost(serializers.ModelSerializer):
         return data
 
     def create_ingredients(self, recipe, ingredients):
-        for ingredient in ingredients:
-            Ingredient.objects.create(
+        Ingredient.objects.bulk_create(
+            Ingredient(
                 recipe=recipe,
                 specification=ingredient['id'],
                 amount=ingredient['amount'],
             )
+            for ingredient in ingredients
+        )
+
+    def update_tags(self, recipe, tags):
+        tags_ids = {tag.id for tag in tags}
+        existing_ids = set(TagRecipe.objects.filter(
+            recipe=recipe).values_list('tag_id', flat=True))
+        if existing_ids - tags_ids:
+            TagRecipe.objects.filter(
+                recipe=recipe, tag_id__in=existing_ids - tags_ids).delete()
+        TagRecipe.objects.bulk_create(
+            TagRecipe(recipe=recipe, tag_id=tag_id)
+            for tag_id in tags_ids - existing_ids
+        )
+
+    def update_ingredients(self, recipe, ingredients):
+        amounts = {ingredient['id'].id: ingredient['amount']
+                   for ingredient in ingredients}
+        to_update = []
+        to_delete = []
+        existing_ids = set()
+        for ingredient in Ingredient.objects.filter(
+                recipe=recipe).order_by('pk'):
+            specification_id = ingredient.specification_id
+            if (specification_id not in amounts
+                    or specification_id in existing_ids):
+                to_delete.append(ingredient.pk)
+            elif ingredient.amount != amounts[specification_id]:
+                ingredient.amount = amounts[specification_id]
+                to_update.append(ingredient)
+            existing_ids.add(specification_id)
+        if to_delete:
+            Ingredient.objects.filter(pk__in=to_delete).delete()
+        if to_update:
+            Ingredient.objects.bulk_update(to_update, ['amount'])
+        Ingredient.objects.bulk_create(
+            Ingredient(
+                recipe=recipe,
+                specification_id=specification_id,
+                amount=amount,
+            )
+            for specification_id, amount in amounts.items()
+            if specification_id not in existing_ids
+        )
 
+    @transaction.atomic
     def create(self, validated_data):
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
+        image = validated_data.pop('image')
         recipe = Recipe.objects.create(
             author=self.context['request'].user, **validated_data)
-        recipe.tags.set(tags)
+        TagRecipe.objects.bulk_create(
+            TagRecipe(recipe=recipe, tag=tag) for tag in tags)
         self.create_ingredients(recipe, ingredients)
+        queue_recipe_image(recipe, image)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
-        instance.tags.clear()
-        instance.ingredients.clear()
-        instance.tags.set(validated_data.pop('tags'))
-        ingredients = validated_data.pop('ingredients')
-        self.create_ingredients(instance, ingredients)
-        return super().update(instance, validated_data)
+        self.update_tags(instance, validated_data.pop('tags'))
+        self.update_ingredients(instance, validated_data.pop('ingredients'))
+        # bulk-операции не отправляют сигналы, поэтому корзины
+        # с этим рецептом сбрасываются явно.
+        invalidate_shopping_carts(shopping_cart=instance)
+        image = validated_data.pop('image', None)
+        if image is not None:
+            queue_recipe_image(instance, image)
+        # image и image_status записывает воркер process_recipe_image_jobs,
+        # поэтому сохраняются только поля запроса: иначе устаревшее
+        # изображение из загруженного объекта затёрло бы новое.
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        instance.save(update_fields=list(validated_data))
+        return instance
 
     def to_representation(self, instance):
+        prefetch_related_objects(
+            [instance], *RecipeSerializer.get_prefetches())
         return RecipeSerializer(instance, context={
             'request': self.context['request']}).data
 
 
 class RecipeAbbreviationSerializer(serializers.ModelSerializer):
+    images = ImageDerivativesField()
+
     class Meta:
         model = Recipe
-        fields = ['id', 'name', 'image', 'cooking_time']
+        fields = ['id', 'name', 'image', 'images', 'cooking_time']
+
+
+class BulkIdsSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.BULK_IDS_LIMIT,
+    )
+
+    def validate_ids(self, value):
+        return list(dict.fromkeys(value))
 
 
 class ChangePasswordSerializer(serializers.ModelSerializer):
@@ -220,7 +506,8 @@ class CreateUserSerializer(serializers.ModelSerializer):
 class UserFavoriteSerializer(serializers.ModelSerializer):
     is_subscribed = SerializerMethodField(method_name='is_subscribed_by_user')
     recipes = RecipeAbbreviationSerializer(many=True)
-    recipes_count = SerializerMethodField(method_name='user_recipes_count')
+    recipes_count = serializers.IntegerField(
+        source='recipes_counter', read_only=True)
 
     class Meta:
         model = User
@@ -230,20 +517,40 @@ class UserFavoriteSerializer(serializers.ModelSerializer):
         ]
 
     def is_subscribed_by_user(self, instance):
-        try:
-            return (self.context['request'].user.following.filter(
-                username=instance).exists())
-        except Exception:
-            return False
+        return is_subscribed(self, instance)
 
-    def user_recipes_count(self, instance):
-        return instance.recipes.count()
+    @staticmethod
+    def get_recipes_limit(request):
+        try:
+            return positive_int(request.query_params['recipes_limit'])
+        except (KeyError, ValueError):
+            return None
+
+    @staticmethod
+    def prefetch_recipes(authors, recipes_limit=None):
+        # Первые recipes_limit рецептов каждого автора выбираются одним
+        # запросом через ROW_NUMBER() OVER (PARTITION BY author_id).
+        recipes = Recipe.objects.order_by('-pub_date', '-id')
+        if recipes_limit is not None:
+            ranked = Recipe.objects.filter(author__in=authors).annotate(
+                row_number=Window(
+                    expression=RowNumber(),
+                    partition_by=F('author_id'),
+                    order_by=(F('pub_date').desc(), F('id').desc()),
+                ),
+            ).values('id', 'row_number')
+            sql, params = ranked.query.sql_with_params()
+            recipes = recipes.filter(id__in=RawSQL(
+                f'SELECT "id" FROM ({sql}) AS "ranked" '
+                'WHERE "row_number" <= %s',
+                (*params, recipes_limit),
+            ))
+        prefetch_related_objects(
+            authors, Prefetch('recipes', queryset=recipes))
 
     def to_representation(self, instance):
         data = super().to_representation(instance)
-        recipes_limit = self.context[
-            'request'].query_params.get('recipes_limit', None)
-        if (recipes_limit is not None
-                and len(data['recipes']) > int(recipes_limit)):
-            data['recipes'] = data['recipes'][:int(recipes_limit)]
+        recipes_limit = self.get_recipes_limit(self.context['request'])
+        if recipes_limit is not None:
+            data['recipes'] = data['recipes'][:recipes_limit]
         return data
@@ -0,0 +1,145 @@
+import logging
+import os
+import tempfile
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from api.utils import get_shopping_cart_ingredients, render_shopping_list
+from recipes.models import ShoppingListJob
+from users.models import User
+
+logger = logging.getLogger(__name__)
+
+
+def invalidate_shopping_carts(**filters):
+    User.objects.filter(**filters).update(
+        shopping_cart_version=F('shopping_cart_version') + 1)
+
+
+def get_shopping_list_name(user, file_format):
+    return '{}-{}-{}.{}'.format(
+        user.pk, user.shopping_cart_version,
+        date.today().isoformat(), file_format)
+
+
+def get_shopping_list_etag(user, file_format):
+    return '"{}"'.format(get_shopping_list_name(user, file_format))
+
+
+def get_cached_shopping_list(user, file_format):
+    path = os.path.join(settings.SHOPPING_LIST_CACHE_DIR,
+                        get_shopping_list_name(user, file_format))
+    try:
+        document = open(path, 'rb')
+    except FileNotFoundError:
+        return None
+    os.utime(path)
+    return document
+
+
+def cache_shopping_list(user, file_format, render):
+    directory = settings.SHOPPING_LIST_CACHE_DIR
+    os.makedirs(directory, exist_ok=True)
+    name = get_shopping_list_name(user, file_format)
+    with tempfile.NamedTemporaryFile(dir=directory, suffix='.tmp',
+                                     delete=False) as output:
+        try:
+            render(output)
+        except BaseException:
+            # Недописанный файл иначе остался бы в кеше навсегда:
+            # вытеснение пропускает временные файлы.
+            output.close()
+            remove_file(output.name)
+            raise
+    os.replace(output.name, os.path.join(directory, name))
+    document = open(os.path.join(directory, name), 'rb')
+    evict_shopping_lists(directory, keep=name, user=user)
+    return document
+
+
+def evict_shopping_lists(directory, keep, user):
+    # Документы старых версий корзины пользователя удаляются сразу,
+    # остальные, в том числе другие форматы текущей версии, — начиная
+    # с давно не использованных, пока общий размер кеша превышает
+    # SHOPPING_LIST_CACHE_MAX_SIZE.
+    prefix = f'{user.pk}-'
+    current = os.path.splitext(keep)[0] + '.'
+    entries = []
+    total_size = 0
+    for entry in os.scandir(directory):
+        if entry.name == keep or entry.name.endswith('.tmp'):
+            continue
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        if (entry.name.startswith(prefix)
+                and not entry.name.startswith(current)):
+            remove_file(entry.path)
+            continue
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total_size += stat.st_size
+    try:
+        total_size += os.path.getsize(os.path.join(directory, keep))
+    except FileNotFoundError:
+        pass
+    entries.sort()
+    for _, size, path in entries:
+        if total_size <= settings.SHOPPING_LIST_CACHE_MAX_SIZE:
+            break
+        remove_file(path)
+        total_size -= size
+
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def take_shopping_list_job():
+    # Задачи, зависшие в RUNNING дольше SHOPPING_LIST_JOB_TIMEOUT,
+    # остались от упавшего воркера и берутся повторно.
+    stale = timezone.now() - timedelta(
+        seconds=settings.SHOPPING_LIST_JOB_TIMEOUT)
+    with transaction.atomic():
+        job = ShoppingListJob.objects.select_for_update(
+            skip_locked=True,
+        ).filter(
+            Q(status=ShoppingListJob.PENDING)
+            | Q(status=ShoppingListJob.RUNNING, started__lt=stale),
+        ).first()
+        if job is None:
+            return None
+        job.status = ShoppingListJob.RUNNING
+        job.started = timezone.now()
+        job.save(update_fields=['status', 'started'])
+    return job
+
+
+def run_shopping_list_job(job):
+    try:
+        with tempfile.TemporaryFile() as output:
+            render_shopping_list(
+                get_shopping_cart_ingredients(job.user).iterator(),
+                job.file_format, output)
+            output.seek(0)
+            job.file.save(f'{job.pk}.{job.file_format}', File(output),
+                          save=False)
+        job.status = ShoppingListJob.DONE
+    except Exception:
+        # Воркер не должен останавливаться из-за одной выгрузки.
+        logger.exception('Не удалось сформировать список покупок %s', job.pk)
+        job.status = ShoppingListJob.FAILED
+    # Строки задачи уже может не быть, если пользователя удалили или
+    # выгрузку удалила clean_shopping_list_jobs, тогда файл не нужен.
+    updated = ShoppingListJob.objects.filter(pk=job.pk).update(
+        status=job.status, file=job.file.name)
+    if not updated and job.file:
+        job.file.delete(save=False)
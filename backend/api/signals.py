@@ -0,0 +1,196 @@
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_save)
+from django.dispatch import receiver
+
+from api.caches import invalidate_tag_catalog
+from api.counters import change_counter
+from api.images import ensure_derivatives, release_image
+from api.paginations import invalidate_counts
+from api.search import invalidate_ingredient_index
+from api.shopping_lists import invalidate_shopping_carts
+from recipes.models import (Ingredient, IngredientSpecification, Recipe,
+                            RecipeImageJob, ShoppingListJob, Tag, TagRecipe,
+                            UserFavoritedRecipe, UserShoppingCart)
+from users.models import Follow, User
+
+
+@receiver(post_save, sender=IngredientSpecification)
+@receiver(post_delete, sender=IngredientSpecification)
+def ingredient_specification_changed(instance, **kwargs):
+    transaction.on_commit(invalidate_ingredient_index)
+    invalidate_shopping_carts(shopping_cart__ingredients=instance.pk)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def tag_changed(**kwargs):
+    transaction.on_commit(invalidate_tag_catalog)
+
+
+@receiver(post_save, sender=UserShoppingCart)
+@receiver(post_delete, sender=UserShoppingCart)
+def shopping_cart_changed(instance, **kwargs):
+    invalidate_shopping_carts(pk=instance.user_id)
+
+
+@receiver(m2m_changed, sender=Recipe.is_in_shopping_cart.through)
+def shopping_cart_m2m_changed(instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if reverse:
+        invalidate_shopping_carts(pk=instance.pk)
+    elif action == 'pre_clear':
+        invalidate_shopping_carts(shopping_cart=instance.pk)
+    else:
+        invalidate_shopping_carts(pk__in=pk_set)
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def ingredient_changed(instance, **kwargs):
+    invalidate_shopping_carts(shopping_cart=instance.recipe_id)
+
+
+# Таблицы, которые участвуют в запросах, считаемых пагинатором: списки
+# рецептов с фильтрами, пользователей и подписок. Версия сбрасывается
+# после фиксации транзакции, иначе параллельный запрос может закэшировать
+# под новой версией количество без новой строки.
+COUNTED_MODELS = (Recipe, Tag, TagRecipe, UserFavoritedRecipe,
+                  UserShoppingCart, User, Follow)
+
+
+def counted_table_changed(sender, **kwargs):
+    table = sender._meta.db_table
+    transaction.on_commit(lambda: invalidate_counts(table))
+
+
+def counted_m2m_changed(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        counted_table_changed(sender)
+
+
+for model in COUNTED_MODELS:
+    post_save.connect(counted_table_changed, sender=model)
+    post_delete.connect(counted_table_changed, sender=model)
+    m2m_changed.connect(counted_m2m_changed, sender=model)
+
+
+# Денормализованные счётчики. Удаления связей (remove, clear, каскад)
+# всегда проходят через post_delete промежуточной модели, а add
+# создаёт строки через bulk_create, поэтому учитывается в m2m_changed.
+@receiver(post_save, sender=Recipe)
+def recipe_created(instance, created, **kwargs):
+    if created:
+        change_counter(
+            User.objects.filter(pk=instance.author_id), 'recipes_counter', 1)
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(instance, **kwargs):
+    change_counter(
+        User.objects.filter(pk=instance.author_id), 'recipes_counter', -1)
+
+
+@receiver(post_save, sender=UserFavoritedRecipe)
+def favorite_created(instance, created, **kwargs):
+    if created:
+        change_counter(Recipe.objects.filter(pk=instance.recipe_id),
+                       'favorites_counter', 1)
+
+
+@receiver(post_delete, sender=UserFavoritedRecipe)
+def favorite_deleted(instance, **kwargs):
+    change_counter(Recipe.objects.filter(pk=instance.recipe_id),
+                   'favorites_counter', -1)
+
+
+@receiver(m2m_changed, sender=Recipe.is_favorited.through)
+def favorites_m2m_changed(instance, action, reverse, pk_set, **kwargs):
+    if action != 'post_add' or not pk_set:
+        return
+    if reverse:
+        change_counter(Recipe.objects.filter(pk__in=pk_set),
+                       'favorites_counter', 1)
+    else:
+        change_counter(Recipe.objects.filter(pk=instance.pk),
+                       'favorites_counter', len(pk_set))
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(instance, created, **kwargs):
+    if created:
+        change_counter(User.objects.filter(pk=instance.following_id),
+                       'followers_counter', 1)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(instance, **kwargs):
+    change_counter(User.objects.filter(pk=instance.following_id),
+                   'followers_counter', -1)
+
+
+@receiver(m2m_changed, sender=User.following.through)
+def following_m2m_changed(instance, action, reverse, pk_set, **kwargs):
+    if action != 'post_add' or not pk_set:
+        return
+    if reverse:
+        change_counter(User.objects.filter(pk=instance.pk),
+                       'followers_counter', len(pk_set))
+    else:
+        change_counter(User.objects.filter(pk__in=pk_set),
+                       'followers_counter', 1)
+
+
+@receiver(pre_save, sender=Recipe)
+def recipe_image_changing(instance, update_fields, **kwargs):
+    # Прежнее изображение запрашивается только при сохранении поля image
+    # существующего рецепта.
+    if update_fields is not None and 'image' not in update_fields:
+        return
+    if instance._state.adding:
+        instance._previous_image = None
+        return
+    instance._previous_image = Recipe.objects.filter(
+        pk=instance.pk).values_list('image', flat=True).first()
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_image_changed(instance, update_fields, **kwargs):
+    if update_fields is not None and 'image' not in update_fields:
+        return
+    previous = getattr(instance, '_previous_image', None)
+    if previous == instance.image.name:
+        return
+    storage = instance.image.storage
+    if previous:
+        transaction.on_commit(lambda: release_image(storage, previous))
+    instance.image_derivatives = (
+        ensure_derivatives(instance.image) if instance.image else {})
+    Recipe.objects.filter(pk=instance.pk).update(
+        image_derivatives=instance.image_derivatives)
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_image_deleted(instance, **kwargs):
+    if instance.image:
+        storage, name = instance.image.storage, instance.image.name
+        transaction.on_commit(lambda: release_image(storage, name))
+
+
+@receiver(post_delete, sender=RecipeImageJob)
+def recipe_image_job_deleted(instance, **kwargs):
+    # Задачи удаляются и каскадом вместе с рецептом, загруженный файл
+    # при этом не должен оставаться в recipes/uploads/.
+    if instance.upload:
+        storage, name = instance.upload.storage, instance.upload.name
+        transaction.on_commit(lambda: storage.delete(name))
+
+
+@receiver(post_delete, sender=ShoppingListJob)
+def shopping_list_job_deleted(instance, **kwargs):
+    # Выгрузки удаляются и каскадом вместе с пользователем, готовый файл
+    # при этом не должен оставаться в shopping_lists/.
+    if instance.file:
+        storage, name = instance.file.storage, instance.file.name
+        transaction.on_commit(lambda: storage.delete(name))
@@ -0,0 +1,103 @@
+# type: ignore
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from recipes.models import (Ingredient, IngredientSpecification, Recipe,
+                            RecipeImageJob, ShoppingListJob, Tag, TagRecipe,
+                            UserFavoritedRecipe, UserShoppingCart)
+from users.models import Follow
+
+User = get_user_model()
+
+CHANGELISTS = [
+    '/admin/recipes/recipe/',
+    '/admin/recipes/ingredient/',
+    '/admin/recipes/tagrecipe/',
+    '/admin/recipes/userfavoritedrecipe/',
+    '/admin/recipes/usershoppingcart/',
+    '/admin/recipes/shoppinglistjob/',
+    '/admin/recipes/recipeimagejob/',
+    '/admin/users/user/',
+    '/admin/users/follow/',
+]
+
+
+class AdminTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(
+            username='admin',
+            email='admin@admin.com',
+            password='password1234',
+        )
+        cls.specification = IngredientSpecification.objects.create(
+            name='test',
+            measurement_unit='test',
+        )
+        cls.tag = Tag.objects.create(
+            name='test',
+            color='#81D8D0',
+            slug='test',
+        )
+        cls.add_rows(1)
+
+    @classmethod
+    def add_rows(cls, count):
+        for _ in range(count):
+            number = User.objects.count()
+            user = User.objects.create(
+                username=f'user_{number}',
+                email=f'user_{number}@user.com',
+            )
+            recipe = Recipe.objects.create(
+                name=f'recipe_{number}',
+                text='text',
+                author=user,
+                cooking_time=1,
+            )
+            Ingredient.objects.create(
+                recipe=recipe, specification=cls.specification, amount=1)
+            TagRecipe.objects.create(tag=cls.tag, recipe=recipe)
+            UserFavoritedRecipe.objects.create(user=user, recipe=recipe)
+            UserShoppingCart.objects.create(user=user, recipe=recipe)
+            ShoppingListJob.objects.create(user=user, file_format='pdf')
+            RecipeImageJob.objects.create(recipe=recipe)
+            Follow.objects.create(follower=cls.admin, following=user)
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def get_num_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_changelists_num_queries(self):
+        """Количество запросов к спискам админки не зависит от числа
+        записей"""
+        num_queries = {url: self.get_num_queries(url) for url in CHANGELISTS}
+        self.add_rows(10)
+        for url in CHANGELISTS:
+            with self.subTest(url=url):
+                self.assertEqual(self.get_num_queries(url), num_queries[url])
+
+    def test_recipe_changelist_ingredients_names(self):
+        """Список ингредиентов в админке рецептов"""
+        response = self.client.get('/admin/recipes/recipe/')
+        self.assertContains(response, self.specification.name)
+
+    def test_recipe_change_page_uses_autocomplete(self):
+        """Ингредиенты рецепта выбираются через автодополнение"""
+        IngredientSpecification.objects.create(
+            name='unused_specification',
+            measurement_unit='test',
+        )
+        recipe = Recipe.objects.first()
+        response = self.client.get(
+            f'/admin/recipes/recipe/{recipe.pk}/change/')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'admin-autocomplete')
+        self.assertNotContains(response, 'unused_specification')
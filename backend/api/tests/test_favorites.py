@@ -2,17 +2,22 @@
 import re
 import shutil
 import tempfile
+import threading
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import TestCase, override_settings
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from rest_framework import status
 from rest_framework.authtoken.models import Token
 from rest_framework.test import APIClient
 
 from recipes.models import (Ingredient, IngredientSpecification,
-                            Recipe, Tag, TagRecipe)
+                            Recipe, Tag, TagRecipe, UserFavoritedRecipe,
+                            UserShoppingCart)
+from users.models import Follow
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 User = get_user_model()
@@ -93,12 +98,13 @@ class UserAPITestCase(TestCase):
             f'/api/recipes/{self.recipe.id}/favorite/')
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         data = response.json()
-        expected_keys = ['id', 'name', 'image', 'cooking_time']
+        expected_keys = ['id', 'name', 'image', 'images',
+                         'cooking_time']
         self.assertListEqual(sorted(data.keys()), sorted(expected_keys))
         self.assertEqual(data['id'], self.recipe.id)
         self.assertEqual(data['name'], self.recipe.name)
         self.assertEqual(data['cooking_time'], self.recipe.cooking_time)
-        image = r'http://testserver/media/recipes/images/small(?:_\w+)?\.gif'
+        image = r'http://testserver/media/recipes/images/[0-9a-f]{64}\.gif'
         self.assertTrue(re.match(image, data['image']))
         response = self.authorized_client.post(
             f'/api/recipes/{self.recipe.id}/favorite/')
@@ -123,3 +129,159 @@ class UserAPITestCase(TestCase):
         response = self.authorized_client.delete(
             f'/api/recipes/{self.recipe.id}/favorite/')
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_favorites_counter(self):
+        """Счётчик избранного обновляется при добавлении и удалении"""
+        self.authorized_client.post(f'/api/recipes/{self.recipe.id}/favorite/')
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_counter, 1)
+        self.recipe.save()
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_counter, 1)
+        self.authorized_client.delete(
+            f'/api/recipes/{self.recipe.id}/favorite/')
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_counter, 0)
+        self.user.favorite_recipes.add(self.recipe)
+        self.user.favorite_recipes.clear()
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_counter, 0)
+
+    def test_favorites_bulk(self):
+        """Проверка эндпоинта /api/recipes/favorite/bulk/"""
+        recipes = [
+            Recipe.objects.create(name=f'bulk_{i}', text='bulk',
+                                  author=self.user, cooking_time=1)
+            for i in range(5)
+        ]
+        ids = [recipe.id for recipe in recipes]
+        url = '/api/recipes/favorite/bulk/'
+        response = self.client.post(url, {'ids': ids}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.authorized_client.post(url, {'ids': []},
+                                               format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.authorized_client.post(url, {'ids': ['x']},
+                                               format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.authorized_client.post(
+            f'/api/recipes/{recipes[0].id}/favorite/')
+        with CaptureQueriesContext(connection) as one:
+            self.authorized_client.post(url, {'ids': ids[1:2]},
+                                        format='json')
+        self.authorized_client.delete(url, {'ids': ids[1:2]}, format='json')
+        with CaptureQueriesContext(connection) as many:
+            response = self.authorized_client.post(
+                url, {'ids': ids + [10 ** 9, ids[1]]}, format='json')
+        self.assertEqual(len(many), len(one))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['results'], [
+            {'id': ids[0], 'status': 'exists'},
+            *({'id': pk, 'status': 'created'} for pk in ids[1:]),
+            {'id': 10 ** 9, 'status': 'not_found'},
+        ])
+        self.assertEqual(self.user.favorite_recipes.count(), len(ids))
+        recipes[1].refresh_from_db()
+        self.assertEqual(recipes[1].favorites_counter, 1)
+        response = self.authorized_client.delete(
+            url, {'ids': ids[:2] + [10 ** 9]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['results'], [
+            {'id': ids[0], 'status': 'deleted'},
+            {'id': ids[1], 'status': 'deleted'},
+            {'id': 10 ** 9, 'status': 'not_found'},
+        ])
+        response = self.authorized_client.delete(
+            url, {'ids': ids[:1]}, format='json')
+        self.assertEqual(response.json()['results'],
+                         [{'id': ids[0], 'status': 'absent'}])
+        recipes[1].refresh_from_db()
+        self.assertEqual(recipes[1].favorites_counter, 0)
+        self.assertEqual(self.user.favorite_recipes.count(), len(ids) - 2)
+        self.user.favorite_recipes.clear()
+
+
+class ConcurrentTogglesTestCase(TransactionTestCase):
+    THREADS = 8
+
+    def setUp(self):
+        self.user = User.objects.create(
+            username='user',
+            email='user@user.com',
+        )
+        self.author = User.objects.create(
+            username='author',
+            email='author@author.com',
+        )
+        self.recipe = Recipe.objects.create(
+            name='test',
+            text='test',
+            author=self.author,
+            cooking_time=10,
+        )
+        self.token = Token.objects.create(user=self.user)
+
+    def run_parallel(self, method, url):
+        barrier = threading.Barrier(self.THREADS)
+        statuses = []
+
+        def request():
+            client = APIClient()
+            client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+            try:
+                barrier.wait()
+                statuses.append(getattr(client, method)(url).status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=request)
+                   for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return sorted(statuses)
+
+    def assert_toggle(self, url, created_status, deleted_status):
+        self.assertEqual(
+            self.run_parallel('post', url),
+            [created_status] + [status.HTTP_400_BAD_REQUEST]
+            * (self.THREADS - 1))
+        self.assertEqual(
+            self.run_parallel('delete', url),
+            [deleted_status] + [status.HTTP_400_BAD_REQUEST]
+            * (self.THREADS - 1))
+
+    def test_parallel_favorite(self):
+        """Параллельные запросы к /api/recipes/{id}/favorite/"""
+        url = f'/api/recipes/{self.recipe.id}/favorite/'
+        self.run_parallel('post', url)
+        self.assertEqual(UserFavoritedRecipe.objects.count(), 1)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_counter, 1)
+        self.run_parallel('delete', url)
+        self.assertFalse(UserFavoritedRecipe.objects.exists())
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_counter, 0)
+        self.assert_toggle(url, status.HTTP_201_CREATED,
+                           status.HTTP_204_NO_CONTENT)
+
+    def test_parallel_shopping_cart(self):
+        """Параллельные запросы к /api/recipes/{id}/shopping_cart/"""
+        url = f'/api/recipes/{self.recipe.id}/shopping_cart/'
+        self.assert_toggle(url, status.HTTP_201_CREATED,
+                           status.HTTP_204_NO_CONTENT)
+        self.assertFalse(UserShoppingCart.objects.exists())
+
+    def test_parallel_subscribe(self):
+        """Параллельные запросы к /api/users/{id}/subscribe/"""
+        url = f'/api/users/{self.author.id}/subscribe/'
+        self.run_parallel('post', url)
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.followers_counter, 1)
+        self.assertEqual(Follow.objects.count(), 1)
+        self.run_parallel('delete', url)
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.followers_counter, 0)
+        self.assert_toggle(url, status.HTTP_201_CREATED,
+                           status.HTTP_204_NO_CONTENT)
@@ -101,7 +101,8 @@ class UserAPITestCase(TestCase):
         response = self.follower_client.get('/api/users/subscriptions/')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         data = response.json()
-        expected_keys = ['count', 'next', 'previous', 'results']
+        expected_keys = ['count', 'count_is_exact', 'next', 'previous',
+                         'results']
         self.assertListEqual(sorted(data.keys()), sorted(expected_keys))
         result = data['results'][0]
         result_expected_keys = ['email', 'id', 'username', 'first_name',
@@ -118,19 +119,104 @@ class UserAPITestCase(TestCase):
                          Recipe.objects.filter(author=self.user).count())
         self.assertTrue(result['is_subscribed'])
         recipe = result['recipes'][0]
-        recipe_expected_keys = ['id', 'name', 'image', 'cooking_time']
+        recipe_expected_keys = ['id', 'name', 'image', 'images',
+                                'cooking_time']
         self.assertListEqual(sorted(recipe.keys()),
                              sorted(recipe_expected_keys))
         self.assertEqual(recipe['id'], self.recipe.id)
         self.assertEqual(recipe['name'], self.recipe.name)
         self.assertEqual(recipe['cooking_time'], self.recipe.cooking_time)
-        image = r'http://testserver/media/recipes/images/small(?:_\w+)?\.gif'
+        image = r'http://testserver/media/recipes/images/[0-9a-f]{64}\.gif'
         self.assertTrue(re.match(image, recipe['image']))
+        response = self.follower_client.get('/api/recipes/')
+        author = response.json()['results'][0]['author']
+        self.assertTrue(author['is_subscribed'])
         Follow.objects.filter(
             follower=self.follower,
             following=self.user,
         ).delete()
 
+    def test_get_subscriptions_recipes_limit(self):
+        """recipes_limit в /api/users/subscriptions/ применяется в SQL,
+        количество запросов не зависит от числа авторов"""
+        # Кэш количества сбрасывается после фиксации транзакции.
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(5):
+                author = User.objects.create(
+                    username=f'author_{i}',
+                    email=f'author_{i}@author.com',
+                )
+                for j in range(i + 1):
+                    Recipe.objects.create(name=f'recipe_{j}', text='text',
+                                          author=author, cooking_time=j + 1)
+                Follow.objects.create(follower=self.follower,
+                                      following=author)
+        self.follower_client.get('/api/users/subscriptions/')
+        with self.assertNumQueries(4):
+            response = self.follower_client.get(
+                '/api/users/subscriptions/?recipes_limit=2&limit=10')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        for result in response.json()['results']:
+            author = User.objects.get(pk=result['id'])
+            recipes = author.recipes.order_by('-pub_date', '-id')
+            self.assertEqual(result['recipes_count'], recipes.count())
+            self.assertEqual([recipe['id'] for recipe in result['recipes']],
+                             [recipe.id for recipe in recipes[:2]])
+        response = self.follower_client.get('/api/users/subscriptions/')
+        self.assertEqual(
+            sorted(len(result['recipes'])
+                   for result in response.json()['results']),
+            [1, 2, 3, 4, 5])
+
+    def test_followers_counter(self):
+        """Счётчик подписчиков обновляется при подписке и отписке"""
+        self.follower_client.post(f'/api/users/{self.user.id}/subscribe/')
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.followers_counter, 1)
+        self.follower_client.delete(f'/api/users/{self.user.id}/subscribe/')
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.followers_counter, 0)
+        Follow.objects.create(follower=self.follower, following=self.user)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.followers_counter, 1)
+        self.follower.following.clear()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.followers_counter, 0)
+
+    def test_subscribe_bulk(self):
+        """Проверка эндпоинта /api/users/subscribe/bulk/"""
+        authors = [
+            User.objects.create(username=f'bulk_{i}',
+                                email=f'bulk_{i}@bulk.com')
+            for i in range(3)
+        ]
+        ids = [author.id for author in authors]
+        url = '/api/users/subscribe/bulk/'
+        response = self.client.post(url, {'ids': ids}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.follower_client.post(
+            url, {'ids': ids + [self.follower.id]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['results'], [
+            *({'id': pk, 'status': 'created'} for pk in ids),
+            {'id': self.follower.id, 'status': 'not_found'},
+        ])
+        for author in authors:
+            author.refresh_from_db()
+            self.assertEqual(author.followers_counter, 1)
+        response = self.follower_client.post(url, {'ids': ids[:1]},
+                                             format='json')
+        self.assertEqual(response.json()['results'],
+                         [{'id': ids[0], 'status': 'exists'}])
+        response = self.follower_client.delete(url, {'ids': ids},
+                                               format='json')
+        self.assertEqual(response.json()['results'],
+                         [{'id': pk, 'status': 'deleted'} for pk in ids])
+        self.assertFalse(self.follower.following.exists())
+        for author in authors:
+            author.refresh_from_db()
+            self.assertEqual(author.followers_counter, 0)
+
     def test_post_subscribe(self):
         """Проверка доступа к эндпоинту
         /api/users/{id}/subscribe/ методом POST"""
@@ -155,13 +241,14 @@ class UserAPITestCase(TestCase):
                          Recipe.objects.filter(author=self.user).count())
         self.assertTrue(data['is_subscribed'])
         recipe = data['recipes'][0]
-        recipe_expected_keys = ['id', 'name', 'image', 'cooking_time']
+        recipe_expected_keys = ['id', 'name', 'image', 'images',
+                                'cooking_time']
         self.assertListEqual(sorted(recipe.keys()),
                              sorted(recipe_expected_keys))
         self.assertEqual(recipe['id'], self.recipe.id)
         self.assertEqual(recipe['name'], self.recipe.name)
         self.assertEqual(recipe['cooking_time'], self.recipe.cooking_time)
-        image = r'http://testserver/media/recipes/images/small(?:_\w+)?\.gif'
+        image = r'http://testserver/media/recipes/images/[0-9a-f]{64}\.gif'
         self.assertTrue(re.match(image, recipe['image']))
         response = self.follower_client.post(
             f'/api/users/{self.user.id}/subscribe/')
@@ -1,8 +1,9 @@
 # type: ignore
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from rest_framework import status
 from rest_framework.test import APIClient
 
+from api.search import invalidate_ingredient_index
 from recipes.models import IngredientSpecification
 
 
@@ -17,6 +18,7 @@ class IngredientsAPITestCase(TestCase):
 
     def setUp(self):
         self.client = APIClient()
+        invalidate_ingredient_index()
 
     def test_get_ingredients_list(self):
         """Проверка доступа к эндпоинту /api/ingredients/ методом GET"""
@@ -43,3 +45,62 @@ class IngredientsAPITestCase(TestCase):
         self.assertEqual(data['name'], self.ingredient.name)
         self.assertEqual(data['measurement_unit'],
                          self.ingredient.measurement_unit)
+
+    def test_search_ingredients(self):
+        """Проверка поиска /api/ingredients/?name= по префиксу,
+        затем по вхождению"""
+        IngredientSpecification.objects.bulk_create([
+            IngredientSpecification(name='Рисовая мука', measurement_unit='г'),
+            IngredientSpecification(name='мука', measurement_unit='г'),
+            IngredientSpecification(name='Мускат', measurement_unit='г'),
+        ])
+        response = self.client.get('/api/ingredients/?name=МУ')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        names = [ingredient['name'] for ingredient in response.json()]
+        self.assertListEqual(names, ['мука', 'Мускат', 'Рисовая мука'])
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/ingredients/?name=мука')
+        names = [ingredient['name'] for ingredient in response.json()]
+        self.assertListEqual(names, ['мука', 'Рисовая мука'])
+        with self.captureOnCommitCallbacks(execute=True):
+            IngredientSpecification.objects.create(
+                name='мука пшеничная', measurement_unit='г')
+        response = self.client.get('/api/ingredients/?name=мука')
+        names = [ingredient['name'] for ingredient in response.json()]
+        self.assertListEqual(names,
+                             ['мука', 'мука пшеничная', 'Рисовая мука'])
+
+    @override_settings(INGREDIENT_SEARCH_BACKEND='trigram',
+                       INGREDIENT_SEARCH_LIMIT=2)
+    def test_search_ingredients_trigram(self):
+        """Проверка поиска /api/ingredients/?name= средствами
+        PostgreSQL"""
+        IngredientSpecification.objects.bulk_create([
+            IngredientSpecification(name='рисовая мука', measurement_unit='г'),
+            IngredientSpecification(name='мука', measurement_unit='г'),
+            IngredientSpecification(name='мускат', measurement_unit='г'),
+        ])
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/ingredients/?name=МУКА')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        names = [ingredient['name'] for ingredient in response.json()]
+        self.assertListEqual(names, ['мука', 'рисовая мука'])
+        response = self.client.get('/api/ingredients/?name=му')
+        names = [ingredient['name'] for ingredient in response.json()]
+        self.assertListEqual(names, ['мука', 'мускат'])
+
+    def test_search_ingredients_index_timeout(self):
+        """Ингредиенты, добавленные без сигналов, появляются в поиске
+        после истечения INGREDIENT_INDEX_TIMEOUT"""
+        response = self.client.get('/api/ingredients/?name=соль')
+        self.assertListEqual(response.json(), [])
+        IngredientSpecification.objects.bulk_create([
+            IngredientSpecification(name='соль', measurement_unit='г'),
+        ])
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/ingredients/?name=соль')
+        self.assertListEqual(response.json(), [])
+        with override_settings(INGREDIENT_INDEX_TIMEOUT=0):
+            response = self.client.get('/api/ingredients/?name=соль')
+        names = [ingredient['name'] for ingredient in response.json()]
+        self.assertListEqual(names, ['соль'])
@@ -1,18 +1,33 @@
 # type: ignore
+import base64
+import json
+import os
 import re
 import shutil
 import tempfile
+import threading
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import TestCase, override_settings
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
 from rest_framework import status
 from rest_framework.authtoken.models import Token
 from rest_framework.test import APIClient
 
+from api.images import (get_derivative_names, queue_recipe_image,
+                        run_recipe_image_job, take_recipe_image_job)
+from api.paginations import invalidate_counts
 from recipes.models import (Ingredient, IngredientSpecification,
-                            Recipe, Tag, TagRecipe)
+                            Recipe, RecipeImageJob, Tag, TagRecipe)
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 User = get_user_model()
@@ -87,16 +102,24 @@ class UserAPITestCase(TestCase):
         self.authorized_client.credentials(HTTP_AUTHORIZATION='Token '
                                            + self.token.key)
 
+    def make_image(self, color):
+        output = BytesIO()
+        Image.new('RGB', (2, 2), color).save(output, 'PNG')
+        return SimpleUploadedFile(name='image.png', content=output.getvalue(),
+                                  content_type='image/png')
+
     def test_get_recipes_list(self):
         """Проверка доступа к эндпоинту /api/recipes/ методом GET"""
         response = self.client.get('/api/recipes/')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         data = response.json()
-        expected_keys = ['count', 'next', 'previous', 'results']
+        expected_keys = ['count', 'count_is_exact', 'next', 'previous',
+                         'results']
         self.assertListEqual(sorted(data.keys()), sorted(expected_keys))
         result_expected_keys = ['id', 'tags', 'author', 'ingredients',
                                 'is_favorited', 'is_in_shopping_cart',
-                                'name', 'image', 'text', 'cooking_time']
+                                'name', 'image', 'images', 'image_status',
+                                'text', 'cooking_time']
         self.assertListEqual(sorted(data['results'][0].keys()),
                              sorted(result_expected_keys))
         result = data['results'][0]
@@ -133,8 +156,412 @@ class UserAPITestCase(TestCase):
         self.assertEqual(result['name'], self.recipe.name)
         self.assertEqual(result['text'], self.recipe.text)
         self.assertEqual(result['cooking_time'], self.recipe.cooking_time)
-        self.assertEqual(result['image'],
-                         'http://testserver/media/recipes/images/small.gif')
+        self.assertRegex(
+            result['image'],
+            r'^http://testserver/media/recipes/images/[0-9a-f]{64}\.gif$')
+
+    def test_get_recipes_list_user_flags(self):
+        """Проверка полей is_favorited и is_in_shopping_cart
+        в /api/recipes/ и /api/recipes/{id}/"""
+        self.recipe.is_favorited.add(self.user)
+        self.recipe.is_in_shopping_cart.add(self.user)
+        response = self.authorized_client.get('/api/recipes/')
+        result = response.json()['results'][0]
+        self.assertTrue(result['is_favorited'])
+        self.assertTrue(result['is_in_shopping_cart'])
+        response = self.authorized_client.get(
+            f'/api/recipes/{self.recipe.id}/')
+        self.assertTrue(response.json()['is_favorited'])
+        self.assertTrue(response.json()['is_in_shopping_cart'])
+        response = self.client.get('/api/recipes/')
+        result = response.json()['results'][0]
+        self.assertFalse(result['is_favorited'])
+        self.assertFalse(result['is_in_shopping_cart'])
+        self.recipe.is_favorited.remove(self.user)
+        self.recipe.is_in_shopping_cart.remove(self.user)
+
+    def test_get_recipes_list_num_queries(self):
+        """Количество запросов к /api/recipes/ не зависит от размера
+        страницы"""
+        recipes = Recipe.objects.bulk_create(
+            Recipe(
+                name=f'num_queries_{i}',
+                text='num_queries',
+                author=self.user,
+                cooking_time=10,
+            )
+            for i in range(99)
+        )
+        Ingredient.objects.bulk_create(
+            Ingredient(
+                recipe=recipe,
+                specification=self.ingredient_specification,
+                amount=10,
+            )
+            for recipe in recipes
+        )
+        TagRecipe.objects.bulk_create(
+            TagRecipe(tag=self.tag, recipe=recipe) for recipe in recipes
+        )
+        # bulk_create не отправляет сигналы, поэтому кэш количества
+        # сбрасывается вручную и прогревается первым запросом.
+        invalidate_counts(Recipe._meta.db_table)
+        self.assertEqual(self.client.get('/api/recipes/').json()['count'], 100)
+        for limit in (1, 10, 100):
+            with self.subTest(limit=limit):
+                with self.assertNumQueries(3):
+                    response = self.client.get(
+                        f'/api/recipes/?limit={limit}')
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertEqual(len(response.json()['results']), limit)
+                with self.assertNumQueries(5):
+                    response = self.authorized_client.get(
+                        f'/api/recipes/?limit={limit}')
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertEqual(len(response.json()['results']), limit)
+
+    def test_get_recipes_list_count_cache(self):
+        """Количество рецептов кэшируется и сбрасывается при изменениях"""
+        invalidate_counts(Recipe._meta.db_table)
+        with CaptureQueriesContext(connection) as first:
+            response = self.client.get('/api/recipes/')
+        self.assertEqual(response.json()['count'], 1)
+        self.assertTrue(response.json()['count_is_exact'])
+        with CaptureQueriesContext(connection) as second:
+            self.client.get('/api/recipes/')
+        self.assertLess(len(second), len(first))
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe = Recipe.objects.create(name='count', text='count',
+                                           author=self.user, cooking_time=1)
+            response = self.client.get('/api/recipes/')
+            self.assertEqual(response.json()['count'], 1)
+        response = self.client.get('/api/recipes/')
+        self.assertEqual(response.json()['count'], 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            IngredientSpecification.objects.create(name='count',
+                                                   measurement_unit='г')
+        with CaptureQueriesContext(connection) as unrelated:
+            self.client.get('/api/recipes/')
+        self.assertFalse(any('COUNT' in query['sql']
+                             for query in unrelated.captured_queries))
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.delete()
+        response = self.client.get('/api/recipes/')
+        self.assertEqual(response.json()['count'], 1)
+
+    @override_settings(PAGINATION_COUNT_ESTIMATE_THRESHOLD=1)
+    def test_get_recipes_list_estimated_count(self):
+        """Для больших выборок отдаётся оценка количества рецептов"""
+        invalidate_counts(Recipe._meta.db_table)
+        response = self.client.get(f'/api/recipes/?author={self.user.pk}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.json()
+        self.assertFalse(data['count_is_exact'])
+        self.assertGreaterEqual(data['count'], 1)
+        self.assertEqual(len(data['results']), 1)
+
+    def test_recipes_counter(self):
+        """Счётчик рецептов автора и команда recount_counters"""
+        self.user.refresh_from_db()
+        recipes_counter = self.user.recipes_counter
+        recipe = Recipe.objects.create(name='counter', text='counter',
+                                       author=self.user, cooking_time=1)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.recipes_counter, recipes_counter + 1)
+        recipe.delete()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.recipes_counter, recipes_counter)
+        User.objects.filter(pk=self.user.pk).update(recipes_counter=100)
+        Recipe.objects.filter(pk=self.recipe.pk).update(favorites_counter=5)
+        call_command('recount_counters', stdout=StringIO())
+        self.user.refresh_from_db()
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.user.recipes_counter,
+                         Recipe.objects.filter(author=self.user).count())
+        self.assertEqual(self.recipe.favorites_counter,
+                         self.recipe.is_favorited.count())
+
+    def test_recipe_image_derivatives(self):
+        """Уменьшенные копии изображения создаются, отдаются в API,
+        удаляются при замене изображения и досоздаются командой"""
+        storage = self.recipe.image.storage
+        names = get_derivative_names(self.recipe.image.name)
+        self.assertEqual(sorted(names), sorted(
+            settings.RECIPE_IMAGE_DERIVATIVES))
+        for name in names.values():
+            self.assertTrue(storage.exists(name))
+        response = self.client.get(f'/api/recipes/{self.recipe.id}/')
+        self.assertEqual(response.json()['images'], {
+            size: f'http://testserver/media/{name}'
+            for size, name in names.items()
+        })
+        recipe = Recipe.objects.create(name='images', text='images',
+                                       author=self.user, cooking_time=1,
+                                       image=self.uploaded)
+        self.assertEqual(recipe.image.name, self.recipe.image.name)
+        recipe.image = self.make_image('red')
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.save()
+        for name in [self.recipe.image.name, *names.values()]:
+            self.assertTrue(storage.exists(name))
+        old_name = recipe.image.name
+        old_names = get_derivative_names(old_name)
+        recipe.image = self.make_image('blue')
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.save()
+        for name in [old_name, *old_names.values()]:
+            self.assertFalse(storage.exists(name))
+        new_names = get_derivative_names(recipe.image.name)
+        # Ссылки на копии берутся из рецепта, без обращений к хранилищу.
+        with mock.patch.object(type(storage), 'exists',
+                               side_effect=AssertionError):
+            response = self.client.get('/api/recipes/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        Recipe.objects.filter(pk=recipe.pk).update(image_derivatives={})
+        for name in new_names.values():
+            storage.delete(name)
+        response = self.client.get(f'/api/recipes/{recipe.id}/')
+        self.assertIsNone(response.json()['images'])
+        call_command('backfill_recipe_images', stdout=StringIO())
+        for name in new_names.values():
+            self.assertTrue(storage.exists(name))
+        response = self.client.get(f'/api/recipes/{recipe.id}/')
+        self.assertEqual(sorted(response.json()['images']),
+                         sorted(new_names))
+        recipe.name = 'renamed'
+        with self.assertNumQueries(1):
+            recipe.save(update_fields=['name'])
+        image_name = recipe.image.name
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.delete()
+        for name in [image_name, *new_names.values()]:
+            self.assertFalse(storage.exists(name))
+
+    def test_gc_media(self):
+        """gc_media удаляет файлы без ссылок из рецептов и загрузки без
+        задач обработки"""
+        storage = self.recipe.image.storage
+        queue_recipe_image(self.recipe, self.make_image('white'))
+        upload = RecipeImageJob.objects.get(recipe=self.recipe).upload
+        upload_storage = upload.storage
+        orphan_upload = upload_storage.save('recipes/uploads/orphan.png',
+                                            self.make_image('gray'))
+        kept = [self.recipe.image.name,
+                *get_derivative_names(self.recipe.image.name).values()]
+        orphan = storage.save('recipes/images/orphan.png',
+                              self.make_image('green'))
+        orphans = [orphan, *get_derivative_names(orphan).values(),
+                   'recipes/images/missing.card.webp']
+        for name in orphans[1:]:
+            with storage.open(name, 'wb') as file:
+                file.write(b'derivative')
+        recent = storage.save('recipes/images/recent.png',
+                              self.make_image('black'))
+        for name in kept + orphans:
+            os.utime(storage.path(name), (0, 0))
+        for name in (upload.name, orphan_upload):
+            os.utime(upload_storage.path(name), (0, 0))
+        output = StringIO()
+        call_command('gc_media', '--dry-run', '--batch-size', '2',
+                     stdout=output)
+        self.assertIn(f'Файлов без ссылок: {len(orphans) + 1},',
+                      output.getvalue())
+        for name in kept + orphans + [recent]:
+            self.assertTrue(storage.exists(name))
+        self.assertTrue(upload_storage.exists(orphan_upload))
+        call_command('gc_media', '--batch-size', '2', stdout=StringIO())
+        for name in kept + [recent]:
+            self.assertTrue(storage.exists(name))
+        for name in orphans:
+            self.assertFalse(storage.exists(name))
+        self.assertTrue(upload_storage.exists(upload.name))
+        self.assertFalse(upload_storage.exists(orphan_upload))
+        storage.delete(recent)
+
+    def test_recipe_image_processing(self):
+        """Изображение рецепта обрабатывается воркером: до обработки
+        остаётся прежнее изображение, ошибка отражается в image_status"""
+        recipe = Recipe.objects.create(name='processing', text='processing',
+                                       author=self.user, cooking_time=1,
+                                       image=self.uploaded)
+        image_name = recipe.image.name
+        recipe_data = {
+            'ingredients': [{'id': self.ingredient_specification.id,
+                             'amount': 1}],
+            'tags': [self.tag.id],
+            'name': 'processing',
+            'text': 'processing',
+            'cooking_time': 1,
+        }
+        response = self.authorized_client.patch(
+            f'/api/recipes/{recipe.id}/',
+            {**recipe_data,
+             'image': 'data:image/png;base64,iVBORw0KGgpub3QgYW4gaW1hZ2U='},
+            format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['image_status'], 'pending')
+        self.assertRegex(response.json()['image'], f'{image_name}$')
+        job = RecipeImageJob.objects.get(recipe=recipe)
+        upload_name = job.upload.name
+        with self.assertLogs('api.images', level='ERROR'):
+            call_command('process_recipe_image_jobs', '--once')
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.image_status, Recipe.IMAGE_FAILED)
+        self.assertEqual(recipe.image.name, image_name)
+        self.assertFalse(recipe.image.storage.exists(upload_name))
+        response = self.authorized_client.patch(
+            f'/api/recipes/{recipe.id}/', {**recipe_data, 'image': 'no'},
+            format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        for _ in range(2):
+            self.authorized_client.patch(
+                f'/api/recipes/{recipe.id}/',
+                {**recipe_data, 'image': self.base64image}, format='json')
+        call_command('process_recipe_image_jobs', '--once')
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.image_status, Recipe.IMAGE_READY)
+        self.assertRegex(recipe.image.name, r'^recipes/images/\w+\.png$')
+        self.assertFalse(RecipeImageJob.objects.filter(
+            recipe=recipe, status=RecipeImageJob.PENDING).exists())
+
+    def test_recipe_image_processing_deleted_recipe(self):
+        """Воркер не останавливается, если рецепт удалён до или во время
+        обработки изображения, и не оставляет файлов"""
+        storage = Recipe._meta.get_field('image').storage
+        open_image = Image.open
+        for color, during in (('orange', False), ('purple', True)):
+            with self.subTest(during=during):
+                recipe = Recipe.objects.create(
+                    name='deleted', text='deleted', author=self.user,
+                    cooking_time=1)
+                image = self.make_image(color)
+                image_name = storage.get_content_name(
+                    'recipes/images/image.png', image)
+                queue_recipe_image(recipe, image)
+                job = take_recipe_image_job()
+                upload_name = job.upload.name
+
+                def delete_and_open(*args, **kwargs):
+                    Recipe.objects.filter(pk=recipe.pk).delete()
+                    return open_image(*args, **kwargs)
+
+                if during:
+                    with mock.patch('api.images.Image.open',
+                                    side_effect=delete_and_open):
+                        run_recipe_image_job(job)
+                else:
+                    recipe.delete()
+                    run_recipe_image_job(job)
+                self.assertFalse(
+                    RecipeImageJob.objects.filter(pk=job.pk).exists())
+                self.assertFalse(storage.exists(upload_name))
+                self.assertFalse(storage.exists(image_name))
+
+    def test_update_recipe_during_image_processing(self):
+        """PATCH без изображения, выполняющийся параллельно с воркером,
+        не затирает сохранённое воркером изображение"""
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe = Recipe.objects.create(
+                name='race', text='race', author=self.user, cooking_time=1,
+                image=self.make_image('maroon'))
+        queue_recipe_image(recipe, self.make_image('olive'))
+        storage = recipe.image.storage
+
+        def run_worker(**kwargs):
+            # Воркер фиксирует новое изображение после того, как запрос
+            # загрузил рецепт.
+            run_recipe_image_job(take_recipe_image_job())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with mock.patch('api.serializers.invalidate_shopping_carts',
+                            side_effect=run_worker):
+                response = self.authorized_client.patch(
+                    f'/api/recipes/{recipe.id}/',
+                    {'ingredients': [{'id': self.ingredient_specification.id,
+                                      'amount': 1}],
+                     'tags': [self.tag.id], 'name': 'race patched'},
+                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.name, 'race patched')
+        self.assertEqual(recipe.image_status, Recipe.IMAGE_READY)
+        self.assertEqual(recipe.image.name, storage.get_content_name(
+            'recipes/images/image.png', self.make_image('olive')))
+        self.assertTrue(storage.exists(recipe.image.name))
+        for name in get_derivative_names(recipe.image.name).values():
+            self.assertTrue(storage.exists(name))
+
+    def test_recipe_image_job_recovery(self):
+        """Зависшая задача берётся повторно, а загруженный файл удаляется
+        вместе с задачей при удалении рецепта"""
+        recipe = Recipe.objects.create(name='stale', text='stale',
+                                       author=self.user, cooking_time=1)
+        queue_recipe_image(recipe, self.make_image('teal'))
+        job = take_recipe_image_job()
+        self.assertIsNone(take_recipe_image_job())
+        RecipeImageJob.objects.filter(pk=job.pk).update(
+            started=timezone.now() - timedelta(
+                seconds=settings.RECIPE_IMAGE_JOB_TIMEOUT + 1))
+        job = take_recipe_image_job()
+        self.assertIsNotNone(job)
+        run_recipe_image_job(job)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.image_status, Recipe.IMAGE_READY)
+        queue_recipe_image(recipe, self.make_image('navy'))
+        upload = RecipeImageJob.objects.get(recipe=recipe).upload
+        self.assertTrue(upload.storage.exists(upload.name))
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.delete()
+        self.assertFalse(upload.storage.exists(upload.name))
+
+    def test_get_recipes_list_cursor(self):
+        """Проверка курсорной пагинации /api/recipes/?pagination=cursor"""
+        Recipe.objects.bulk_create(
+            Recipe(name=f'cursor_{i}', text='cursor', author=self.user,
+                   cooking_time=1)
+            for i in range(6)
+        )
+        expected = list(Recipe.objects.order_by(
+            '-pub_date', '-id').values_list('id', flat=True))
+        received = []
+        url = '/api/recipes/?pagination=cursor&limit=2'
+        while url:
+            with self.assertNumQueries(3):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            data = response.json()
+            self.assertListEqual(sorted(data.keys()), ['next', 'results'])
+            received.extend(recipe['id'] for recipe in data['results'])
+            url = data['next']
+        self.assertListEqual(received, expected)
+        response = self.client.get('/api/recipes/?cursor=invalid')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_get_recipes_list_cursor_index(self):
+        """Курсор ограничивает сканирование индекса (pub_date, id), а не
+        отбрасывает фильтром строки предыдущих страниц"""
+        Recipe.objects.bulk_create(
+            Recipe(name=f'index_{i}', text='index', author=self.user,
+                   cooking_time=1)
+            for i in range(2)
+        )
+        response = self.client.get('/api/recipes/?pagination=cursor&limit=1')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(response.json()['next'])
+        sql = next(query['sql'] for query in queries.captured_queries
+                   if 'ORDER BY "recipes_recipe"."pub_date" DESC'
+                   in query['sql'])
+        with connection.cursor() as cursor:
+            # В тестовой таблице несколько строк, и без этого планировщик
+            # выбрал бы последовательное чтение.
+            cursor.execute('SET enable_seqscan = off')
+            try:
+                cursor.execute(f'EXPLAIN {sql}')
+                plan = '\n'.join(row[0] for row in cursor.fetchall())
+            finally:
+                cursor.execute('RESET enable_seqscan')
+        self.assertIn('recipe_pub_date_id_idx', plan)
+        self.assertRegex(plan, r'Index Cond: \(pub_date <=')
 
     def test_create_recipe(self):
         """Проверка создания нового рецепта POST методом /api/recipes/"""
@@ -162,8 +589,8 @@ class UserAPITestCase(TestCase):
         self.assertEqual(counter + 1, Recipe.objects.all().count())
         data = response.json()
         expected_keys = ['id', 'tags', 'author', 'ingredients', 'is_favorited',
-                         'is_in_shopping_cart', 'name', 'image', 'text',
-                         'cooking_time']
+                         'is_in_shopping_cart', 'name', 'image', 'images',
+                         'image_status', 'text', 'cooking_time']
         self.assertListEqual(sorted(data.keys()), sorted(expected_keys))
         tag = data['tags'][0]
         tag_expected_keys = ['id', 'name', 'color', 'slug']
@@ -197,9 +624,196 @@ class UserAPITestCase(TestCase):
         self.assertEqual(data['name'], 'create_test')
         self.assertEqual(data['text'], 'create_test')
         self.assertEqual(data['cooking_time'], 50)
+        self.assertEqual(data['image_status'], 'pending')
+        call_command('process_recipe_image_jobs', '--once')
+        data = self.client.get(f'/api/recipes/{data["id"]}/').json()
+        self.assertEqual(data['image_status'], 'ready')
         image = r'http://testserver/media/recipes/images/(.+?)\.png'
         self.assertTrue(re.match(image, data['image']))
 
+    def test_create_recipe_validation(self):
+        """Проверка ингредиентов и тегов при создании рецепта"""
+        specifications = IngredientSpecification.objects.bulk_create(
+            IngredientSpecification(name=f'bulk_{i}', measurement_unit='г')
+            for i in range(10)
+        )
+        tags = Tag.objects.bulk_create(
+            Tag(name=f'bulk_{i}', color='#000000', slug=f'bulk_{i}')
+            for i in range(3)
+        )
+        recipe_data = {
+            'ingredients': [
+                {'id': self.ingredient_specification.id, 'amount': 1},
+                {'id': 0, 'amount': 1},
+            ],
+            'tags': [self.tag.id],
+            'image': self.base64image,
+            'name': 'validation',
+            'text': 'validation',
+            'cooking_time': 1,
+        }
+        response = self.authorized_client.post('/api/recipes/',
+                                               data=recipe_data)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        errors = response.json()['ingredients']
+        self.assertEqual(errors[0], {})
+        self.assertIn('"0"', errors[1]['id'][0])
+        recipe_data['ingredients'][1]['id'] = self.ingredient_specification.id
+        response = self.authorized_client.post('/api/recipes/',
+                                               data=recipe_data)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json()['ingredients'],
+                         ['Вы указали одинаковые ингредиенты'])
+        recipe_data['ingredients'].pop()
+        recipe_data['tags'] = [self.tag.id, 0]
+        response = self.authorized_client.post('/api/recipes/',
+                                               data=recipe_data)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('"0"', response.json()['tags'][0])
+        recipe_data['tags'] = [self.tag.id, self.tag.id]
+        response = self.authorized_client.post('/api/recipes/',
+                                               data=recipe_data)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json()['tags'],
+                         ['Вы указали одинаковые теги'])
+        recipe_data['tags'] = [self.tag.id]
+        with CaptureQueriesContext(connection) as small_recipe:
+            response = self.authorized_client.post('/api/recipes/',
+                                                   data=recipe_data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        recipe_data['ingredients'] = [
+            {'id': specification.id, 'amount': 1}
+            for specification in specifications
+        ]
+        recipe_data['tags'] = [tag.id for tag in tags]
+        with CaptureQueriesContext(connection) as big_recipe:
+            response = self.authorized_client.post('/api/recipes/',
+                                                   data=recipe_data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.json()['ingredients']), 10)
+        self.assertEqual(len(small_recipe), len(big_recipe))
+
+    def test_create_recipe_image_validation(self):
+        """Размер и формат изображения проверяются до постановки в очередь"""
+        recipe_data = {
+            'ingredients': [{'id': self.ingredient_specification.id,
+                             'amount': 1}],
+            'tags': [self.tag.id],
+            'name': 'image validation',
+            'text': 'image validation',
+            'cooking_time': 1,
+        }
+        invalid_images = (
+            'data:image/png;base64,bm90IGFuIGltYWdl',
+            'data:image/png;base64,bm90IGFu*GltYWdl',
+            'data:image/png;base64,bm90',
+            '',
+        )
+        for image in invalid_images:
+            with self.subTest(image=image):
+                response = self.authorized_client.post(
+                    '/api/recipes/', {**recipe_data, 'image': image},
+                    format='json')
+                self.assertEqual(response.status_code,
+                                 status.HTTP_400_BAD_REQUEST)
+                self.assertIn('image', response.json())
+        with override_settings(RECIPE_IMAGE_MAX_SIZE=100):
+            response = self.authorized_client.post(
+                '/api/recipes/', {**recipe_data, 'image': self.base64image},
+                format='json')
+            self.assertEqual(response.status_code,
+                             status.HTTP_400_BAD_REQUEST)
+            self.assertIn('100', response.json()['image'][0])
+        self.assertFalse(RecipeImageJob.objects.exists())
+        with override_settings(RECIPE_IMAGE_MAX_SIZE=200):
+            response = self.authorized_client.post(
+                '/api/recipes/', {**recipe_data, 'image': self.base64image},
+                format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        job = RecipeImageJob.objects.get()
+        self.assertRegex(job.upload.name, r'^recipes/uploads/\w+\.png$')
+        content = b'\x89PNG\r\n\x1a\n' + os.urandom(200 * 1024)
+        response = self.authorized_client.post(
+            '/api/recipes/',
+            {**recipe_data,
+             'image': 'data:image/png;base64,'
+                      + base64.b64encode(content).decode()},
+            format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        job = RecipeImageJob.objects.latest('created')
+        with job.upload.open('rb') as upload:
+            self.assertEqual(upload.read(), content)
+        # Base64 с переводами строк и без выравнивания '=' тоже принимается.
+        response = self.authorized_client.post(
+            '/api/recipes/',
+            {**recipe_data,
+             'image': 'data:image/png;base64,'
+                      + base64.encodebytes(content).decode().rstrip('=\n')},
+            format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        job = RecipeImageJob.objects.latest('created')
+        with job.upload.open('rb') as upload:
+            self.assertEqual(upload.read(), content)
+
+    def test_create_recipe_multipart(self):
+        """Создание и изменение рецепта с изображением в multipart-запросе"""
+        recipe_data = {
+            'ingredients': [{'id': self.ingredient_specification.id,
+                             'amount': 1}],
+            'tags': [self.tag.id],
+            'name': 'multipart',
+            'text': 'multipart',
+            'cooking_time': 1,
+        }
+        response = self.authorized_client.post(
+            '/api/recipes/',
+            {'data': json.dumps(recipe_data),
+             'image': SimpleUploadedFile('photo.gif', self.small_gif,
+                                         content_type='image/gif')},
+            format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.json()['image_status'], 'pending')
+        self.assertEqual(len(response.json()['ingredients']), 1)
+        recipe = Recipe.objects.get(pk=response.json()['id'])
+        job = RecipeImageJob.objects.get(recipe=recipe)
+        self.assertRegex(job.upload.name, r'^recipes/uploads/\w+\.gif$')
+        call_command('process_recipe_image_jobs', '--once')
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.image_status, Recipe.IMAGE_READY)
+        self.assertRegex(recipe.image.name, r'^recipes/images/\w+\.gif$')
+        response = self.authorized_client.patch(
+            f'/api/recipes/{recipe.id}/',
+            {'data': json.dumps({**recipe_data, 'name': 'multipart patch'}),
+             'image': SimpleUploadedFile('photo.gif', self.small_gif,
+                                         content_type='image/gif')},
+            format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['name'], 'multipart patch')
+        self.assertEqual(response.json()['image_status'], 'pending')
+        invalid_requests = (
+            {'data': '{"name": ', 'image': SimpleUploadedFile(
+                'photo.gif', self.small_gif, content_type='image/gif')},
+            {'data': '[]', 'image': SimpleUploadedFile(
+                'photo.gif', self.small_gif, content_type='image/gif')},
+            {'data': json.dumps(recipe_data), 'image': SimpleUploadedFile(
+                'photo.gif', b'not an image', content_type='image/gif')},
+        )
+        for data in invalid_requests:
+            with self.subTest(data=data['data']):
+                response = self.authorized_client.post(
+                    '/api/recipes/', data, format='multipart')
+                self.assertEqual(response.status_code,
+                                 status.HTTP_400_BAD_REQUEST)
+        with override_settings(RECIPE_IMAGE_MAX_SIZE=10):
+            response = self.authorized_client.post(
+                '/api/recipes/',
+                {'data': json.dumps(recipe_data),
+                 'image': SimpleUploadedFile('photo.gif', self.small_gif,
+                                             content_type='image/gif')},
+                format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('10', response.json()['image'][0])
+
     def test_update_recipe(self):
         """Проверка редактирования нового рецепта
         PATCH методом /api/recipes/{id}/"""
@@ -276,8 +890,8 @@ class UserAPITestCase(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         data = response.json()
         expected_keys = ['id', 'tags', 'author', 'ingredients', 'is_favorited',
-                         'is_in_shopping_cart', 'name', 'image', 'text',
-                         'cooking_time']
+                         'is_in_shopping_cart', 'name', 'image', 'images',
+                         'image_status', 'text', 'cooking_time']
         self.assertListEqual(sorted(data.keys()), sorted(expected_keys))
         tag = data['tags'][0]
         tag_expected_keys = ['id', 'name', 'color', 'slug']
@@ -310,9 +924,64 @@ class UserAPITestCase(TestCase):
         self.assertEqual(data['name'], 'update_test')
         self.assertEqual(data['text'], 'update_test')
         self.assertEqual(data['cooking_time'], 50)
+        self.assertEqual(data['image_status'], 'pending')
+        call_command('process_recipe_image_jobs', '--once')
+        data = self.client.get(f'/api/recipes/{data["id"]}/').json()
+        self.assertEqual(data['image_status'], 'ready')
         image = r'http://testserver/media/recipes/images/(.+?)\.png'
         self.assertTrue(re.match(image, data['image']))
 
+    def test_update_recipe_ingredients_diff(self):
+        """Редактирование рецепта затрагивает только изменённые
+        ингредиенты и теги"""
+        specifications = IngredientSpecification.objects.bulk_create(
+            IngredientSpecification(name=f'diff_{i}', measurement_unit='г')
+            for i in range(3)
+        )
+        recipe = Recipe.objects.create(
+            name='diff',
+            text='diff',
+            author=self.user,
+            cooking_time=10,
+        )
+        kept = Ingredient.objects.create(
+            recipe=recipe, specification=specifications[0], amount=10)
+        changed = Ingredient.objects.create(
+            recipe=recipe, specification=specifications[1], amount=20)
+        tag_recipe = TagRecipe.objects.create(tag=self.tag, recipe=recipe)
+        recipe_data = {
+            'ingredients': [
+                {'id': specifications[0].id, 'amount': 10},
+                {'id': specifications[1].id, 'amount': 30},
+                {'id': specifications[2].id, 'amount': 5},
+            ],
+            'tags': [self.tag.id],
+            'image': self.base64image,
+            'name': 'diff',
+            'text': 'diff',
+            'cooking_time': 10,
+        }
+        response = self.authorized_client.patch(f'/api/recipes/{recipe.id}/',
+                                                data=recipe_data)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        amounts = {ingredient['id']: ingredient['amount']
+                   for ingredient in response.json()['ingredients']}
+        self.assertDictEqual(amounts, {specifications[0].id: 10,
+                                       specifications[1].id: 30,
+                                       specifications[2].id: 5})
+        self.assertTrue(Ingredient.objects.filter(
+            pk=kept.pk, amount=10).exists())
+        self.assertTrue(Ingredient.objects.filter(
+            pk=changed.pk, amount=30).exists())
+        self.assertTrue(TagRecipe.objects.filter(pk=tag_recipe.pk).exists())
+        recipe_data['ingredients'] = [
+            {'id': specifications[2].id, 'amount': 5}]
+        response = self.authorized_client.patch(f'/api/recipes/{recipe.id}/',
+                                                data=recipe_data)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.json()['ingredients']), 1)
+        self.assertEqual(Ingredient.objects.filter(recipe=recipe).count(), 1)
+
     def test_delete_recipe(self):
         """Проверка удаления рецепта DELETE методом /api/recipes/{id}/"""
         tag = Tag.objects.create(
@@ -357,3 +1026,65 @@ class UserAPITestCase(TestCase):
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
         response = self.authorized_client.delete(f'/api/recipes/{recipe.id}/')
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class SharedImageTestCase(TransactionTestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def test_release_waits_for_uncommitted_reference(self):
+        """Общий файл не удаляется, пока другой рецепт сохраняет на него
+        ссылку в незафиксированной транзакции"""
+        # У рецептов разные авторы, чтобы удаление не ждало блокировки
+        # строки автора при обновлении счётчика рецептов.
+        author, other_author = User.objects.bulk_create(
+            User(username=username, email=f'{username}@author.com')
+            for username in ('author', 'other_author'))
+        output = BytesIO()
+        Image.new('RGB', (2, 2), 'olive').save(output, 'PNG')
+
+        def make_image():
+            return SimpleUploadedFile(name='image.png',
+                                      content=output.getvalue(),
+                                      content_type='image/png')
+
+        recipe = Recipe.objects.create(name='first', text='first',
+                                       author=author, cooking_time=1,
+                                       image=make_image())
+        storage, name = recipe.image.storage, recipe.image.name
+        saved = threading.Event()
+        released = threading.Event()
+
+        def save_reference():
+            try:
+                with transaction.atomic():
+                    Recipe.objects.create(name='second', text='second',
+                                          author=other_author,
+                                          cooking_time=1,
+                                          image=make_image())
+                    saved.set()
+                    released.wait(0.5)
+            finally:
+                connection.close()
+
+        def release():
+            try:
+                recipe.delete()
+            finally:
+                released.set()
+                connection.close()
+
+        writer = threading.Thread(target=save_reference)
+        writer.start()
+        saved.wait()
+        releaser = threading.Thread(target=release)
+        releaser.start()
+        writer.join()
+        releaser.join()
+        self.assertEqual(Recipe.objects.get().image.name, name)
+        self.assertTrue(storage.exists(name))
+        for derivative in get_derivative_names(name).values():
+            self.assertTrue(storage.exists(derivative))
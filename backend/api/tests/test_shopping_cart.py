@@ -1,24 +1,37 @@
 # type: ignore
+import io
+import json
+import os
 import re
 import shutil
 import tempfile
+from datetime import timedelta
+from unittest import mock
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
 from django.test import TestCase, override_settings
+from django.utils import timezone
 from rest_framework import status
 from rest_framework.authtoken.models import Token
 from rest_framework.test import APIClient
 
+from api.shopping_lists import (cache_shopping_list, get_cached_shopping_list,
+                                run_shopping_list_job, take_shopping_list_job)
+from api.utils import get_shopping_cart_ingredients, render_shopping_list
 from recipes.models import (Ingredient, IngredientSpecification,
-                            Recipe, Tag, TagRecipe)
+                            Recipe, ShoppingListJob, Tag, TagRecipe,
+                            UserShoppingCart)
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+TEMP_CACHE_DIR = os.path.join(TEMP_MEDIA_ROOT, 'shopping_lists')
 User = get_user_model()
 
 
-@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT,
+                   SHOPPING_LIST_CACHE_DIR=TEMP_CACHE_DIR)
 class UserAPITestCase(TestCase):
     @classmethod
     def setUpClass(cls):
@@ -76,6 +89,7 @@ class UserAPITestCase(TestCase):
         shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
 
     def setUp(self):
+        shutil.rmtree(TEMP_CACHE_DIR, ignore_errors=True)
         self.client = APIClient()
         self.authorized_client = APIClient()
         self.token = Token.objects.create(user=self.user)
@@ -94,12 +108,13 @@ class UserAPITestCase(TestCase):
             f'/api/recipes/{self.recipe.id}/shopping_cart/')
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         data = response.json()
-        expected_keys = ['id', 'name', 'image', 'cooking_time']
+        expected_keys = ['id', 'name', 'image', 'images',
+                         'cooking_time']
         self.assertListEqual(sorted(data.keys()), sorted(expected_keys))
         self.assertEqual(data['id'], self.recipe.id)
         self.assertEqual(data['name'], self.recipe.name)
         self.assertEqual(data['cooking_time'], self.recipe.cooking_time)
-        image = r'http://testserver/media/recipes/images/small(?:_\w+)?\.gif'
+        image = r'http://testserver/media/recipes/images/[0-9a-f]{64}\.gif'
         self.assertTrue(re.match(image, data['image']))
         response = self.authorized_client.post(
             f'/api/recipes/{self.recipe.id}/shopping_cart/')
@@ -125,6 +140,37 @@ class UserAPITestCase(TestCase):
             f'/api/recipes/{self.recipe.id}/shopping_cart/')
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_shopping_cart_bulk(self):
+        """Проверка эндпоинта /api/recipes/shopping_cart/bulk/
+        и сброса кеша списка покупок"""
+        url = '/api/recipes/shopping_cart/bulk/'
+        response = self.client.post(url, {'ids': [self.recipe.id]},
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        etag = self.authorized_client.get(
+            '/api/recipes/download_shopping_cart/')['ETag']
+        response = self.authorized_client.post(
+            url, {'ids': [self.recipe.id, 10 ** 9]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['results'], [
+            {'id': self.recipe.id, 'status': 'created'},
+            {'id': 10 ** 9, 'status': 'not_found'},
+        ])
+        self.assertTrue(self.user.shopping_cart.filter(
+            pk=self.recipe.id).exists())
+        response = self.authorized_client.get(
+            '/api/recipes/download_shopping_cart/')
+        self.assertNotEqual(response['ETag'], etag)
+        etag = response['ETag']
+        response = self.authorized_client.delete(
+            url, {'ids': [self.recipe.id]}, format='json')
+        self.assertEqual(response.json()['results'],
+                         [{'id': self.recipe.id, 'status': 'deleted'}])
+        self.assertFalse(self.user.shopping_cart.exists())
+        response = self.authorized_client.get(
+            '/api/recipes/download_shopping_cart/')
+        self.assertNotEqual(response['ETag'], etag)
+
     def test_get_shopping_cart(self):
         """Проверка доступа к эндпоинту
         /api/recipes/download_shopping_cart/ методом GET"""
@@ -133,3 +179,251 @@ class UserAPITestCase(TestCase):
         response = self.authorized_client.get(
             '/api/recipes/download_shopping_cart/')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_get_shopping_cart_num_queries(self):
+        """Количество запросов к /api/recipes/download_shopping_cart/
+        не зависит от размера корзины"""
+        salt = IngredientSpecification.objects.create(
+            name='соль', measurement_unit='г')
+        recipes = Recipe.objects.bulk_create(
+            Recipe(name=f'cart_{i}', text='cart', author=self.user,
+                   cooking_time=1)
+            for i in range(50)
+        )
+        Ingredient.objects.bulk_create(
+            Ingredient(recipe=recipe, specification=specification, amount=2)
+            for recipe in recipes
+            for specification in (salt, self.ingredient_specification)
+        )
+        for size in (1, 50):
+            with self.subTest(size=size):
+                UserShoppingCart.objects.filter(user=self.user).delete()
+                UserShoppingCart.objects.bulk_create(
+                    UserShoppingCart(user=self.user, recipe=recipe)
+                    for recipe in recipes[:size]
+                )
+                shutil.rmtree(TEMP_CACHE_DIR, ignore_errors=True)
+                with self.assertNumQueries(2):
+                    response = self.authorized_client.get(
+                        '/api/recipes/download_shopping_cart/')
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                totals = {
+                    ingredient['name']: ingredient['total_amount']
+                    for ingredient in get_shopping_cart_ingredients(self.user)
+                }
+                self.assertDictEqual(totals, {
+                    'соль': 2 * size,
+                    self.ingredient_specification.name: 2 * size,
+                })
+
+    def test_get_shopping_cart_pages(self):
+        """Длинный список покупок разбивается на страницы"""
+        recipe = Recipe.objects.create(
+            name='pages', text='pages', author=self.user, cooking_time=1)
+        specifications = IngredientSpecification.objects.bulk_create(
+            IngredientSpecification(name=f'pages_{i}', measurement_unit='г')
+            for i in range(60)
+        )
+        Ingredient.objects.bulk_create(
+            Ingredient(recipe=recipe, specification=specification, amount=1)
+            for specification in specifications
+        )
+        recipe.is_in_shopping_cart.add(self.user)
+        response = self.authorized_client.get(
+            '/api/recipes/download_shopping_cart/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        content = b''.join(response.streaming_content)
+        self.assertTrue(content.startswith(b'%PDF'))
+        self.assertGreater(len(re.findall(rb'/Type /Page\b', content)), 1)
+
+    def test_get_shopping_cart_cache(self):
+        """Повторная выгрузка списка покупок отдаётся из кеша"""
+        response = self.authorized_client.get(
+            '/api/recipes/download_shopping_cart/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        content = b''.join(response.streaming_content)
+        etag = response['ETag']
+        with self.assertNumQueries(1):
+            response = self.authorized_client.get(
+                '/api/recipes/download_shopping_cart/')
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(b''.join(response.streaming_content), content)
+        with self.assertNumQueries(1):
+            response = self.authorized_client.get(
+                '/api/recipes/download_shopping_cart/',
+                HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.authorized_client.post(
+            f'/api/recipes/{self.recipe.id}/shopping_cart/')
+        response = self.authorized_client.get(
+            '/api/recipes/download_shopping_cart/',
+            HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        etag = response['ETag']
+        ingredient = Ingredient.objects.get(pk=self.ingredient.pk)
+        ingredient.amount = 200
+        ingredient.save()
+        response = self.authorized_client.get(
+            '/api/recipes/download_shopping_cart/',
+            HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.recipe.is_in_shopping_cart.remove(self.user)
+
+    def test_get_shopping_cart_cache_formats(self):
+        """Форматы одной версии корзины кешируются независимо"""
+        url = '/api/recipes/download_shopping_cart/'
+        for file_format in ('pdf', 'csv'):
+            response = self.authorized_client.get(
+                f'{url}?format={file_format}')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            b''.join(response.streaming_content)
+        for file_format in ('pdf', 'csv', 'pdf'):
+            with self.subTest(file_format=file_format):
+                with mock.patch('api.views.render_shopping_list') as render:
+                    response = self.authorized_client.get(
+                        f'{url}?format={file_format}')
+                    b''.join(response.streaming_content)
+                render.assert_not_called()
+        self.assertEqual(len(os.listdir(TEMP_CACHE_DIR)), 2)
+
+    @override_settings(SHOPPING_LIST_CACHE_MAX_SIZE=150)
+    def test_shopping_list_cache_eviction(self):
+        """Кеш списков покупок не превышает заданный размер"""
+        users = [User(pk=1000 + i) for i in range(3)]
+        for user in users:
+            cache_shopping_list(
+                user, 'txt', lambda output: output.write(b'x' * 60)).close()
+        self.assertIsNone(get_cached_shopping_list(users[0], 'txt'))
+        for user in users[1:]:
+            document = get_cached_shopping_list(user, 'txt')
+            self.assertIsNotNone(document)
+            document.close()
+        users[1].shopping_cart_version += 1
+        cache_shopping_list(
+            users[1], 'txt', lambda output: output.write(b'x')).close()
+        self.assertEqual(len(os.listdir(TEMP_CACHE_DIR)), 2)
+
+        def failing_render(output):
+            output.write(b'x')
+            raise ValueError('render failed')
+
+        with self.assertRaises(ValueError):
+            cache_shopping_list(users[2], 'pdf', failing_render)
+        self.assertEqual(len(os.listdir(TEMP_CACHE_DIR)), 2)
+
+    def test_get_shopping_cart_formats(self):
+        """Проверка выгрузки списка покупок в форматах txt, csv и json"""
+        self.recipe.is_in_shopping_cart.add(self.user)
+        url = '/api/recipes/download_shopping_cart/'
+        line = (f'{self.ingredient_specification.name} '
+                f'({self.ingredient.amount}) - '
+                f'{self.ingredient_specification.measurement_unit}')
+        response = self.authorized_client.get(url + '?format=txt')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        self.assertEqual(b''.join(response.streaming_content).decode(),
+                         line + '\n')
+        response = self.authorized_client.get(url, HTTP_ACCEPT='text/csv')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/csv'))
+        self.assertEqual(
+            b''.join(response.streaming_content).decode().splitlines(),
+            ['name,amount,measurement_unit',
+             f'{self.ingredient_specification.name},{self.ingredient.amount},'
+             f'{self.ingredient_specification.measurement_unit}'])
+        response = self.authorized_client.get(url + '?format=json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            json.loads(b''.join(response.streaming_content)),
+            [{'name': self.ingredient_specification.name,
+              'amount': self.ingredient.amount,
+              'measurement_unit':
+              self.ingredient_specification.measurement_unit}])
+        response = self.authorized_client.get(url)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        response = self.authorized_client.get(url + '?format=xml')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.recipe.is_in_shopping_cart.remove(self.user)
+
+    def test_get_shopping_cart_async(self):
+        """Проверка асинхронной выгрузки списка покупок"""
+        self.recipe.is_in_shopping_cart.add(self.user)
+        response = self.authorized_client.get(
+            '/api/recipes/download_shopping_cart/?async=1&format=txt')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        data = response.json()
+        self.assertEqual(data['status'], ShoppingListJob.PENDING)
+        url = f'/api/recipes/download_shopping_cart/jobs/{data["id"]}/'
+        self.assertTrue(response['Location'].endswith(url))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.authorized_client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        call_command('process_shopping_list_jobs', once=True)
+        response = self.authorized_client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        self.assertIn(self.ingredient_specification.name,
+                      b''.join(response.streaming_content).decode())
+        other = User.objects.create(username='other', email='other@other.com')
+        other_client = APIClient()
+        other_client.force_authenticate(other)
+        response = other_client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        job = ShoppingListJob.objects.get(pk=data['id'])
+        path = job.file.path
+        call_command('clean_shopping_list_jobs', stdout=io.StringIO())
+        self.assertTrue(ShoppingListJob.objects.filter(pk=job.pk).exists())
+        with override_settings(SHOPPING_LIST_JOB_TTL=-1):
+            with self.captureOnCommitCallbacks(execute=True):
+                call_command('clean_shopping_list_jobs',
+                             stdout=io.StringIO())
+        self.assertFalse(ShoppingListJob.objects.filter(pk=job.pk).exists())
+        self.assertFalse(os.path.exists(path))
+        job = ShoppingListJob.objects.create(user=self.user, file_format='txt',
+                                             status=ShoppingListJob.FAILED)
+        response = self.authorized_client.get(
+            f'/api/recipes/download_shopping_cart/jobs/{job.pk}/')
+        self.assertEqual(response.status_code,
+                         status.HTTP_500_INTERNAL_SERVER_ERROR)
+        self.assertEqual(response.json()['status'], ShoppingListJob.FAILED)
+        self.assertIn('errors', response.json())
+        self.recipe.is_in_shopping_cart.remove(self.user)
+
+    def test_shopping_list_job_recovery(self):
+        """Зависшая выгрузка берётся повторно, а удаление пользователя во
+        время формирования не останавливает воркер и не оставляет файлов"""
+        user = User.objects.create(username='gone', email='gone@gone.com')
+        ShoppingListJob.objects.create(user=user, file_format='txt')
+        job = take_shopping_list_job()
+        self.assertIsNone(take_shopping_list_job())
+        ShoppingListJob.objects.filter(pk=job.pk).update(
+            started=timezone.now() - timedelta(
+                seconds=settings.SHOPPING_LIST_JOB_TIMEOUT + 1))
+        job = take_shopping_list_job()
+        self.assertIsNotNone(job)
+
+        def delete_and_render(*args, **kwargs):
+            User.objects.filter(pk=user.pk).delete()
+            return render_shopping_list(*args, **kwargs)
+
+        with mock.patch('api.shopping_lists.render_shopping_list',
+                        side_effect=delete_and_render):
+            run_shopping_list_job(job)
+        self.assertFalse(ShoppingListJob.objects.filter(pk=job.pk).exists())
+        self.assertFalse(job.file.storage.exists(
+            f'shopping_lists/{job.pk}.txt'))
+        user = User.objects.create(username='gone', email='gone@gone.com')
+        ShoppingListJob.objects.create(user=user, file_format='txt')
+        job = take_shopping_list_job()
+        run_shopping_list_job(job)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ShoppingListJob.DONE)
+        self.assertTrue(job.file.storage.exists(job.file.name))
+        with self.captureOnCommitCallbacks(execute=True):
+            user.delete()
+        self.assertFalse(job.file.storage.exists(job.file.name))
@@ -1,8 +1,10 @@
 # type: ignore
+from django.core.cache import cache
 from django.test import TestCase
 from rest_framework import status
 from rest_framework.test import APIClient
 
+from api.caches import TAG_CATALOG_CACHE_KEY, invalidate_tag_catalog
 from recipes.models import Tag
 
 
@@ -18,6 +20,7 @@ class TagAPITestCase(TestCase):
 
     def setUp(self):
         self.client = APIClient()
+        invalidate_tag_catalog()
 
     def test_get_tags_list(self):
         """Проверка доступа к эндпоинту /api/tags/ методом GET"""
@@ -44,3 +47,35 @@ class TagAPITestCase(TestCase):
         self.assertEqual(data['name'], self.tag.name)
         self.assertEqual(data['color'], self.tag.color)
         self.assertEqual(data['slug'], self.tag.slug)
+
+    def test_tags_list_etag(self):
+        """Проверка ETag и ответа 304 для /api/tags/"""
+        response = self.client.get('/api/tags/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+        self.assertIn('no-cache', response['Cache-Control'])
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/tags/',
+                                       HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        with self.captureOnCommitCallbacks(execute=True):
+            Tag.objects.create(name='new_tag', color='#000000',
+                               slug='new_tag')
+        response = self.client.get('/api/tags/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(response.json()), 2)
+
+    def test_tags_catalog_eviction(self):
+        """После вытеснения каталога из кэша отдаются актуальные теги"""
+        response = self.client.get('/api/tags/')
+        etag = response['ETag']
+        Tag.objects.filter(pk=self.tag.pk).update(name='renamed')
+        cache.delete(TAG_CATALOG_CACHE_KEY)
+        response = self.client.get('/api/tags/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()[0]['name'], 'renamed')
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/tags/')
+        self.assertEqual(response.json()[0]['name'], 'renamed')
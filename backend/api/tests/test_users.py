@@ -60,7 +60,8 @@ class UserAPITestCase(TestCase):
         response = self.client.get('/api/users/')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         data = response.json()
-        expected_keys = ['count', 'next', 'previous', 'results']
+        expected_keys = ['count', 'count_is_exact', 'next', 'previous',
+                         'results']
         self.assertListEqual(sorted(data.keys()), sorted(expected_keys))
         result = data['results'][0]
         result_expected_keys = ['email', 'id', 'username', 'first_name',
@@ -1,31 +1,50 @@
+import csv
+import io
+import json
 import os
 from datetime import datetime
 
 from django.conf import settings
-from django.http import HttpResponse
+from django.db.models import F, Sum
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
 
+from recipes.models import Ingredient
+
+
+def get_shopping_cart_ingredients(user):
+    return Ingredient.objects.filter(
+        recipe__is_in_shopping_cart=user,
+    ).values(
+        name=F('specification__name'),
+        measurement_unit=F('specification__measurement_unit'),
+    ).annotate(
+        total_amount=Sum('amount'),
+    ).order_by('name', 'measurement_unit')
+
+
+def format_ingredient(ingredient):
+    return (ingredient['name']
+            + ' (' + str(ingredient['total_amount']) + ') - '
+            + ingredient['measurement_unit'])
+
 
 def dict_to_print_data(data):
     result_data = []
     for ingredient in data:
-        result_data.append(
-            ingredient['name']
-            + ' (' + str(ingredient['amount']) + ') - '
-            + ingredient['measurement_unit'])
+        result_data.append(format_ingredient(ingredient))
     result_data.sort()
     return result_data
 
 
-def generate_pdf(data):
-    response = HttpResponse(content_type='application/pdf')
-    response[
-        'Content-Disposition'] = 'attachment; filename="shopping_cart.pdf"'
+def register_fonts():
     font_path = os.path.join(settings.BASE_DIR, 'static', 'fonts', 'arial.ttf')
     pdfmetrics.registerFont(TTFont('Arial', font_path))
+
+
+def render_pdf(data, output):
     top_margin = 42.52  # 15 mm
     bottom_margin = 56.69  # 20 mm
     left_margin = 85.04  # 30 mm
@@ -33,7 +52,7 @@ def generate_pdf(data):
     line_spacing = 10
     width = A4[0] - (left_margin + right_margin)
     height = A4[1] - (top_margin + bottom_margin)
-    c = canvas.Canvas(response, pagesize=(width, height))
+    c = canvas.Canvas(output, pagesize=(width, height))
     header_font_size = 18
     font_size = 12
     c.setFont("Arial", header_font_size)
@@ -42,9 +61,57 @@ def generate_pdf(data):
     c.setFont("Arial", font_size)
     y_position = height - top_margin - header_font_size - line_spacing
     for item in data:
+        if y_position < bottom_margin:
+            c.showPage()
+            c.setFont("Arial", font_size)
+            y_position = height - top_margin
         c.drawString(left_margin, y_position, "\u25A1")
         x_offset = left_margin + 15
         c.drawString(x_offset, y_position, item)
         y_position -= font_size + line_spacing
     c.save()
-    return response
+
+
+def render_txt(ingredients, output):
+    text = io.TextIOWrapper(output, encoding='utf-8', newline='')
+    for ingredient in ingredients:
+        text.write(format_ingredient(ingredient) + '\n')
+    text.detach()
+
+
+def render_csv(ingredients, output):
+    text = io.TextIOWrapper(output, encoding='utf-8', newline='')
+    writer = csv.writer(text)
+    writer.writerow(['name', 'amount', 'measurement_unit'])
+    for ingredient in ingredients:
+        writer.writerow([ingredient['name'], ingredient['total_amount'],
+                         ingredient['measurement_unit']])
+    text.detach()
+
+
+def render_json(ingredients, output):
+    text = io.TextIOWrapper(output, encoding='utf-8')
+    text.write('[')
+    for position, ingredient in enumerate(ingredients):
+        if position:
+            text.write(',')
+        json.dump({
+            'name': ingredient['name'],
+            'amount': ingredient['total_amount'],
+            'measurement_unit': ingredient['measurement_unit'],
+        }, text, ensure_ascii=False)
+    text.write(']')
+    text.detach()
+
+
+def render_shopping_list(ingredients, file_format, output):
+    if file_format == 'pdf':
+        render_pdf(dict_to_print_data(ingredients), output)
+    elif file_format == 'txt':
+        render_txt(ingredients, output)
+    elif file_format == 'csv':
+        render_csv(ingredients, output)
+    elif file_format == 'json':
+        render_json(ingredients, output)
+    else:
+        raise ValueError(f'Неизвестный формат списка покупок: {file_format}')
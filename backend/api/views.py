@@ -1,23 +1,65 @@
-from django.db.models import Q
+from django.db.models import BooleanField, Exists, OuterRef, Value
+from django.http import FileResponse
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import parse_etags
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import exceptions, filters, status
 from rest_framework.decorators import action
+from rest_framework.parsers import JSONParser
 from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework.validators import ValidationError
 from rest_framework.viewsets import ModelViewSet
 
+from api.caches import get_tag_catalog
 from api.filters import RecipeFilter
+from api.paginations import PubDateCursorPagination
+from api.parsers import MultiPartJSONParser
 from api.permissions import IsAuthor
-from api.serializers import (ChangePasswordSerializer, CreateUserSerializer,
+from api.relations import (create_relation, create_relations,
+                           delete_relation, delete_relations)
+from api.renderers import (SHOPPING_LIST_RENDERERS,
+                           get_shopping_list_content_type)
+from api.search import search_ingredients
+from api.serializers import (BulkIdsSerializer, ChangePasswordSerializer,
+                             CreateUserSerializer,
                              IngredientSpecificationSerializer,
                              RecipeAbbreviationSerializer, RecipeSerializer,
                              RecipeSerializerPost, TagSerializer,
                              UserFavoriteSerializer, UserSerializer)
-from api.utils import dict_to_print_data, generate_pdf
-from recipes.models import IngredientSpecification, Recipe, Tag
-from users.models import User
+from api.shopping_lists import (cache_shopping_list,
+                                get_cached_shopping_list,
+                                get_shopping_list_etag)
+from api.utils import get_shopping_cart_ingredients, render_shopping_list
+from recipes.models import (IngredientSpecification, Recipe, ShoppingListJob,
+                            Tag, UserFavoritedRecipe, UserShoppingCart)
+from users.models import Follow, User
+
+
+def bulk_relations_response(request, relation, queryset):
+    # Пакетное добавление (POST) или удаление (DELETE) связей текущего
+    # пользователя: ключи проверяются одним запросом, изменения
+    # применяются одним INSERT или DELETE, результат — по каждому ключу.
+    serializer = BulkIdsSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    ids = serializer.validated_data['ids']
+    found = set(queryset.filter(pk__in=ids).values_list('pk', flat=True))
+    if request.method == 'POST':
+        changed = create_relations(relation, request.user, found)
+        changed_status, unchanged_status = 'created', 'exists'
+    else:
+        changed = delete_relations(relation, request.user, found)
+        changed_status, unchanged_status = 'deleted', 'absent'
+    return Response({'results': [
+        {'id': pk,
+         'status': ('not_found' if pk not in found
+                    else changed_status if pk in changed
+                    else unchanged_status)}
+        for pk in ids
+    ]})
 
 
 class IngredientSpecificationViewSet(ModelViewSet):
@@ -29,17 +71,11 @@ class IngredientSpecificationViewSet(ModelViewSet):
     filter_backends = [filters.SearchFilter]
     search_fields = ['name']
 
-    def get_queryset(self):
-        queryset = super().get_queryset()
-        search_term = self.request.GET.get('name', None)
-        if search_term:
-            starts_with_filter = Q(name__istartswith=search_term)
-            contains_filter = Q(name__icontains=search_term)
-            queryset = queryset.filter(starts_with_filter | contains_filter)
-            queryset = sorted(queryset,
-                              key=lambda x: not x.name.lower().startswith(
-                                  search_term.lower()))
-        return queryset
+    def list(self, request, *args, **kwargs):
+        search_term = request.query_params.get('name')
+        if not search_term:
+            return super().list(request, *args, **kwargs)
+        return Response(search_ingredients(search_term))
 
 
 class TagViewSet(ModelViewSet):
@@ -49,13 +85,55 @@ class TagViewSet(ModelViewSet):
     http_method_names = ['get']
     pagination_class = None
 
+    def list(self, request, *args, **kwargs):
+        catalog = get_tag_catalog()
+        etags = parse_etags(request.headers.get('If-None-Match', ''))
+        if catalog.etag in etags or '*' in etags:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(catalog.data)
+        response['ETag'] = catalog.etag
+        patch_cache_control(response, public=True, no_cache=True)
+        return response
+
 
 class RecipeViewSet(ModelViewSet):
     queryset = Recipe.objects.all()
     http_method_names = ['get', 'post', 'patch', 'delete']
+    parser_classes = (JSONParser, MultiPartJSONParser)
     filter_backends = (DjangoFilterBackend, )
     filterset_class = RecipeFilter
 
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            params = self.request.query_params
+            if (params.get('pagination') == 'cursor'
+                    or PubDateCursorPagination.cursor_query_param in params):
+                self._paginator = PubDateCursorPagination()
+            else:
+                self._paginator = super().paginator
+        return self._paginator
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in ['list', 'retrieve']:
+            queryset = queryset.select_related('author').prefetch_related(
+                *RecipeSerializer.get_prefetches())
+        user = self.request.user
+        if not user.is_authenticated:
+            return queryset.annotate(
+                user_favorited=Value(False, output_field=BooleanField()),
+                user_in_shopping_cart=Value(
+                    False, output_field=BooleanField()),
+            )
+        return queryset.annotate(
+            user_favorited=Exists(UserFavoritedRecipe.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            user_in_shopping_cart=Exists(UserShoppingCart.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+        )
+
     def get_permissions(self):
         if self.action in ['list', 'retrieve']:
             permission_classes = [AllowAny]
@@ -78,9 +156,9 @@ class RecipeViewSet(ModelViewSet):
         serializer_class=RecipeAbbreviationSerializer,)
     def favorite(self, request, pk=None):
         recipe = get_object_or_404(Recipe, pk=pk)
-        if recipe in request.user.favorite_recipes.all():
+        if not create_relation(UserFavoritedRecipe,
+                               user_id=request.user.pk, recipe_id=recipe.pk):
             raise ValidationError({"errors": "вы уже добавили рецепт"})
-        recipe.is_favorited.add(request.user)
         return Response(RecipeAbbreviationSerializer(
                         recipe, context={'request': request}).data,
                         status=status.HTTP_201_CREATED)
@@ -88,9 +166,9 @@ class RecipeViewSet(ModelViewSet):
     @favorite.mapping.delete
     def delete_favorite(self, request, pk=None):
         recipe = get_object_or_404(Recipe, pk=pk)
-        if recipe not in request.user.favorite_recipes.all():
+        if not delete_relation(UserFavoritedRecipe,
+                               user_id=request.user.pk, recipe_id=recipe.pk):
             raise ValidationError({"errors": "вы не добавляли рецепт"})
-        recipe.is_favorited.remove(request.user)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(
@@ -100,9 +178,9 @@ class RecipeViewSet(ModelViewSet):
         serializer_class=RecipeAbbreviationSerializer,)
     def shopping_cart(self, request, pk=None):
         recipe = get_object_or_404(Recipe, pk=pk)
-        if recipe in request.user.shopping_cart.all():
+        if not create_relation(UserShoppingCart,
+                               user_id=request.user.pk, recipe_id=recipe.pk):
             raise ValidationError({"errors": "вы уже добавили рецепт"})
-        recipe.is_in_shopping_cart.add(request.user)
         return Response(RecipeAbbreviationSerializer(
                         recipe, context={'request': request}).data,
                         status=status.HTTP_201_CREATED)
@@ -110,29 +188,100 @@ class RecipeViewSet(ModelViewSet):
     @shopping_cart.mapping.delete
     def delete_shopping_cart(self, request, pk=None):
         recipe = get_object_or_404(Recipe, pk=pk)
-        if recipe not in request.user.shopping_cart.all():
+        if not delete_relation(UserShoppingCart,
+                               user_id=request.user.pk, recipe_id=recipe.pk):
             raise ValidationError({"errors": "вы не добавляли рецепт"})
-        recipe.is_in_shopping_cart.remove(request.user)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
-    @action(detail=False)
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        permission_classes=[IsAuthenticated],
+        url_path='favorite/bulk',
+        url_name='favorite-bulk',)
+    def favorite_bulk(self, request):
+        return bulk_relations_response(
+            request, User.favorite_recipes, Recipe.objects.all())
+
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        permission_classes=[IsAuthenticated],
+        url_path='shopping_cart/bulk',
+        url_name='shopping-cart-bulk',)
+    def shopping_cart_bulk(self, request):
+        return bulk_relations_response(
+            request, User.shopping_cart, Recipe.objects.all())
+
+    def use_json_renderer(self):
+        self.request.accepted_renderer = JSONRenderer()
+        self.request.accepted_media_type = JSONRenderer.media_type
+
+    def handle_exception(self, exc):
+        response = super().handle_exception(exc)
+        if self.action == 'download_shopping_cart':
+            self.use_json_renderer()
+        return response
+
+    @action(
+        detail=False,
+        renderer_classes=SHOPPING_LIST_RENDERERS,)
     def download_shopping_cart(self, request):
         if not request.user.is_authenticated:
             raise exceptions.NotAuthenticated()
-        grouped_ingredients = {}
-        for recipe in request.user.shopping_cart.all():
-            for ingredient in recipe.ingredient_set.all():
-                pk = ingredient.specification.pk
-                if pk in grouped_ingredients:
-                    grouped_ingredients[pk]['amount'] += ingredient.amount
-                else:
-                    grouped_ingredients[pk] = {
-                        'name': ingredient.specification.name,
-                        'measurement_unit':
-                        ingredient.specification.measurement_unit,
-                        'amount': ingredient.amount,
-                    }
-        return generate_pdf(dict_to_print_data(grouped_ingredients.values()))
+        user = request.user
+        file_format = request.accepted_renderer.format
+        if request.query_params.get('async') in ('1', 'true'):
+            job = ShoppingListJob.objects.create(
+                user=user, file_format=file_format)
+            self.use_json_renderer()
+            return Response(
+                {'id': job.pk, 'status': job.status},
+                status=status.HTTP_202_ACCEPTED,
+                headers={'Location': request.build_absolute_uri(reverse(
+                    'recipes-download-shopping-cart-job',
+                    kwargs={'job_id': job.pk}))},
+            )
+        etag = get_shopping_list_etag(user, file_format)
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            document = get_cached_shopping_list(user, file_format)
+            if document is None:
+                document = cache_shopping_list(
+                    user, file_format, lambda output: render_shopping_list(
+                        get_shopping_cart_ingredients(user).iterator(),
+                        file_format, output))
+            response = FileResponse(
+                document, as_attachment=True,
+                filename=f'shopping_cart.{file_format}',
+                content_type=get_shopping_list_content_type(file_format))
+        response['ETag'] = etag
+        patch_vary_headers(response, ['Accept'])
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    @action(
+        detail=False,
+        url_path=r'download_shopping_cart/jobs/(?P<job_id>[0-9a-f-]{36})',
+        url_name='download-shopping-cart-job',)
+    def download_shopping_cart_job(self, request, job_id=None):
+        if not request.user.is_authenticated:
+            raise exceptions.NotAuthenticated()
+        job = get_object_or_404(ShoppingListJob, pk=job_id, user=request.user)
+        if job.status == ShoppingListJob.FAILED:
+            return Response(
+                {'id': job.pk, 'status': job.status,
+                 'errors': 'Не удалось сформировать список покупок.'},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            )
+        if job.status != ShoppingListJob.DONE:
+            return Response({'id': job.pk, 'status': job.status},
+                            status=status.HTTP_202_ACCEPTED)
+        return FileResponse(
+            job.file.open('rb'), as_attachment=True,
+            filename=f'shopping_cart.{job.file_format}',
+            content_type=get_shopping_list_content_type(job.file_format))
 
 
 class UserViewSet(ModelViewSet):
@@ -162,7 +311,8 @@ class UserViewSet(ModelViewSet):
         permission_classes=[IsAuthenticated],
         url_path='me',)
     def get_current_user_info(self, request):
-        serializer = UserSerializer(request.user)
+        serializer = UserSerializer(
+            request.user, context={'request': request})
         return Response(serializer.data)
 
     @action(
@@ -182,13 +332,17 @@ class UserViewSet(ModelViewSet):
         url_path='subscriptions',)
     def get_subscriptions(self, request):
         queryset = request.user.following.all()
+        recipes_limit = UserFavoriteSerializer.get_recipes_limit(request)
         page = self.paginate_queryset(queryset)
         if page is not None:
+            UserFavoriteSerializer.prefetch_recipes(page, recipes_limit)
             serializer = UserFavoriteSerializer(
                 page,
                 many=True,
                 context={'request': request},)
             return self.get_paginated_response(serializer.data)
+        queryset = list(queryset)
+        UserFavoriteSerializer.prefetch_recipes(queryset, recipes_limit)
         serializer = UserFavoriteSerializer(
             queryset,
             many=True,
@@ -202,18 +356,31 @@ class UserViewSet(ModelViewSet):
         serializer_class=UserFavoriteSerializer,)
     def subscribe(self, request, pk=None):
         author = get_object_or_404(User, pk=pk)
-        if author in request.user.following.all():
-            raise ValidationError({"errors": "вы уже подписаны"})
         if author == request.user:
             raise ValidationError({"errors": "нельзя подписаться на себя"})
-        request.user.following.add(author)
+        if not create_relation(Follow, follower_id=request.user.pk,
+                               following_id=author.pk):
+            raise ValidationError({"errors": "вы уже подписаны"})
+        UserFavoriteSerializer.prefetch_recipes(
+            [author], UserFavoriteSerializer.get_recipes_limit(request))
         return Response(UserFavoriteSerializer(author, context={
             'request': request},).data, status=status.HTTP_201_CREATED)
 
     @subscribe.mapping.delete
     def delete_subscribe(self, request, pk=None):
         author = get_object_or_404(User, pk=pk)
-        if author not in request.user.following.all():
+        if not delete_relation(Follow, follower_id=request.user.pk,
+                               following_id=author.pk):
             raise ValidationError({"errors": "вы не подписаны на автора"})
-        request.user.following.remove(author)
         return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        permission_classes=[IsAuthenticated],
+        url_path='subscribe/bulk',
+        url_name='subscribe-bulk',)
+    def subscribe_bulk(self, request):
+        return bulk_relations_response(
+            request, User.following,
+            User.objects.exclude(pk=request.user.pk))
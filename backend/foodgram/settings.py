@@ -81,6 +81,18 @@ DATABASES = {
     }
 }
 
+# Версии каталога тегов и индекса ингредиентов общие для всех процессов
+# (воркеры gunicorn, обработчики очередей, manage.py), поэтому в рабочем
+# окружении кэш должен быть общим. Без CACHE_LOCATION используется
+# локальная память процесса, что подходит только для разработки и тестов.
+if os.getenv('CACHE_LOCATION'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+            'LOCATION': os.getenv('CACHE_LOCATION'),
+        },
+    }
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -139,6 +151,36 @@ DJOSER = {
     'LOGIN_FIELD': 'email',
 }
 
+INGREDIENT_SEARCH_BACKEND = os.getenv('INGREDIENT_SEARCH_BACKEND', 'memory')
+INGREDIENT_SEARCH_LIMIT = int(os.getenv('INGREDIENT_SEARCH_LIMIT', 50))
+INGREDIENT_INDEX_TIMEOUT = int(os.getenv('INGREDIENT_INDEX_TIMEOUT', 5 * 60))
+
+SHOPPING_LIST_CACHE_DIR = os.getenv(
+    'SHOPPING_LIST_CACHE_DIR', BASE_DIR / 'cache' / 'shopping_lists')
+SHOPPING_LIST_CACHE_MAX_SIZE = int(os.getenv(
+    'SHOPPING_LIST_CACHE_MAX_SIZE', 50 * 1024 * 1024))
+SHOPPING_LIST_JOB_TTL = int(os.getenv('SHOPPING_LIST_JOB_TTL', 24 * 60 * 60))
+SHOPPING_LIST_JOB_TIMEOUT = int(os.getenv('SHOPPING_LIST_JOB_TIMEOUT',
+                                          10 * 60))
+
+PAGINATION_COUNT_CACHE_TIMEOUT = int(os.getenv(
+    'PAGINATION_COUNT_CACHE_TIMEOUT', 30))
+PAGINATION_COUNT_ESTIMATE_THRESHOLD = int(os.getenv(
+    'PAGINATION_COUNT_ESTIMATE_THRESHOLD', 10000))
+
+RECIPE_IMAGE_DERIVATIVES = {
+    'card': (320, 320),
+    'retina': (640, 640),
+    'detail': (1200, 1200),
+}
+RECIPE_IMAGE_FORMAT = os.getenv('RECIPE_IMAGE_FORMAT', 'WEBP')
+RECIPE_IMAGE_QUALITY = int(os.getenv('RECIPE_IMAGE_QUALITY', 80))
+RECIPE_IMAGE_MAX_SIZE = int(os.getenv('RECIPE_IMAGE_MAX_SIZE',
+                                      10 * 1024 * 1024))
+RECIPE_IMAGE_JOB_TIMEOUT = int(os.getenv('RECIPE_IMAGE_JOB_TIMEOUT', 10 * 60))
+
+BULK_IDS_LIMIT = int(os.getenv('BULK_IDS_LIMIT', 100))
+
 NAME_LENGHT = 200
 EMAIL_LENGHT = 254
 USER_PROFILE_LENGHT = 150
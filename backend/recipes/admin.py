@@ -1,12 +1,15 @@
 from django.contrib import admin
+from django.contrib.postgres.aggregates import StringAgg
 
-from recipes.models import (Ingredient, IngredientSpecification, Recipe, Tag,
-                            TagRecipe, UserFavoritedRecipe, UserShoppingCart)
+from recipes.models import (Ingredient, IngredientSpecification, Recipe,
+                            RecipeImageJob, ShoppingListJob, Tag, TagRecipe,
+                            UserFavoritedRecipe, UserShoppingCart)
 
 
 class IngredientInline(admin.TabularInline):
     model = Ingredient
     min_num = 1
+    autocomplete_fields = ['specification']
 
 
 class TagRecipeInline(admin.TabularInline):
@@ -18,12 +21,28 @@ class RecipeAdmin(admin.ModelAdmin):
     inlines = [IngredientInline, TagRecipeInline]
     search_fields = ['author__username', 'name', 'tags__name']
     list_display = ['name', 'author', 'favorites_counter', 'ingredients_names']
+    list_select_related = ['author']
     readonly_fields = ['favorites_counter']
+    autocomplete_fields = ['author']
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            ingredients_names_list=StringAgg(
+                'ingredients__name', ', ', distinct=True,
+                ordering='ingredients__name'),
+        )
+
+    @admin.display(description='Список ингредиентов')
+    def ingredients_names(self, obj):
+        return obj.ingredients_names_list
 
 
 class IngredientAdmin(admin.ModelAdmin):
     list_display = ['specification', 'recipe', 'amount']
+    list_select_related = ['specification', 'recipe']
     search_fields = ['specification__name']
+    autocomplete_fields = ['specification']
+    raw_id_fields = ['recipe']
 
 
 class IngredientSpecificationAdmin(admin.ModelAdmin):
@@ -31,10 +50,36 @@ class IngredientSpecificationAdmin(admin.ModelAdmin):
     search_fields = ['name']
 
 
+class TagRecipeAdmin(admin.ModelAdmin):
+    list_select_related = ['tag', 'recipe']
+    raw_id_fields = ['recipe']
+
+
+class RecipeUserAdmin(admin.ModelAdmin):
+    list_select_related = ['user', 'recipe']
+    raw_id_fields = ['user', 'recipe']
+
+
+class ShoppingListJobAdmin(admin.ModelAdmin):
+    list_display = ['user', 'file_format', 'status', 'created', 'started']
+    list_select_related = ['user']
+    list_filter = ['status']
+    raw_id_fields = ['user']
+
+
+class RecipeImageJobAdmin(admin.ModelAdmin):
+    list_display = ['recipe', 'status', 'created', 'started']
+    list_select_related = ['recipe']
+    list_filter = ['status']
+    raw_id_fields = ['recipe']
+
+
 admin.site.register(Recipe, RecipeAdmin)
 admin.site.register(Tag)
-admin.site.register(TagRecipe)
+admin.site.register(TagRecipe, TagRecipeAdmin)
 admin.site.register(Ingredient, IngredientAdmin)
 admin.site.register(IngredientSpecification, IngredientSpecificationAdmin)
-admin.site.register(UserFavoritedRecipe)
-admin.site.register(UserShoppingCart)
+admin.site.register(UserFavoritedRecipe, RecipeUserAdmin)
+admin.site.register(UserShoppingCart, RecipeUserAdmin)
+admin.site.register(ShoppingListJob, ShoppingListJobAdmin)
+admin.site.register(RecipeImageJob, RecipeImageJobAdmin)
@@ -0,0 +1,23 @@
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0001_initial'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        # Django строит icontains/istartswith как UPPER("name"::text) LIKE,
+        # поэтому индекс построен по тому же выражению.
+        migrations.RunSQL(
+            sql=(
+                'CREATE INDEX ingredient_name_trgm '
+                'ON recipes_ingredientspecification '
+                'USING gin (UPPER(name::text) gin_trgm_ops);'
+            ),
+            reverse_sql='DROP INDEX ingredient_name_trgm;',
+        ),
+    ]
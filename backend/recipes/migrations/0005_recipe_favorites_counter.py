@@ -0,0 +1,31 @@
+# Generated by Django 3.2.3 on 2026-10-17 06:13
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_favorites_counter(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    UserFavoritedRecipe = apps.get_model('recipes', 'UserFavoritedRecipe')
+    Recipe.objects.update(favorites_counter=Coalesce(Subquery(
+        UserFavoritedRecipe.objects.filter(recipe=OuterRef('pk')).order_by()
+        .values('recipe').annotate(count=Count('pk')).values('count')
+    ), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0004_recipe_pub_date_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_counter',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В избранных'),
+        ),
+        migrations.RunPython(fill_favorites_counter,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.2.3 on 2026-10-17 06:29
+
+from django.db import migrations, models
+import recipes.storages
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_recipe_image_jobs'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=models.ImageField(blank=True, db_index=True, default=None, null=True, storage=recipes.storages.ContentAddressedStorage(), upload_to='recipes/images/', verbose_name='Изображение'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.3 on 2026-10-17 06:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_recipe_image_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipeimagejob',
+            name='started',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Начато'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.3 on 2026-10-17 07:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_recipe_image_job_started'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shoppinglistjob',
+            name='started',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Начато'),
+        ),
+    ]
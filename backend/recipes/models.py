@@ -1,8 +1,11 @@
+import uuid
+
 from colorfield.fields import ColorField
 from django.conf import settings
 from django.db import models
 
-from users.models import User
+from recipes.storages import ContentAddressedStorage
+from users.models import CounterFieldsMixin, User
 
 
 class Tag(models.Model):
@@ -55,7 +58,16 @@ class IngredientSpecification(models.Model):
         return self.name + ', ' + self.measurement_unit
 
 
-class Recipe(models.Model):
+class Recipe(CounterFieldsMixin, models.Model):
+    IMAGE_PENDING = 'pending'
+    IMAGE_READY = 'ready'
+    IMAGE_FAILED = 'failed'
+    IMAGE_STATUSES = (
+        (IMAGE_PENDING, 'Обрабатывается'),
+        (IMAGE_READY, 'Готово'),
+        (IMAGE_FAILED, 'Ошибка'),
+    )
+
     name = models.CharField(
         max_length=settings.NAME_LENGHT,
         verbose_name='Название',
@@ -80,9 +92,11 @@ class Recipe(models.Model):
     )
     image = models.ImageField(
         upload_to='recipes/images/',
+        storage=ContentAddressedStorage(),
         blank=True,
         null=True,
         default=None,
+        db_index=True,
         verbose_name='Изображение',
     )
     ingredients = models.ManyToManyField(
@@ -107,12 +121,26 @@ class Recipe(models.Model):
         related_name='shopping_cart',
         verbose_name='В корзине',
     )
+    favorites_counter = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В избранных',
+    )
+    image_status = models.CharField(
+        max_length=7,
+        choices=IMAGE_STATUSES,
+        default=IMAGE_READY,
+        editable=False,
+        verbose_name='Состояние изображения',
+    )
+    image_derivatives = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        verbose_name='Уменьшенные копии',
+    )
 
-    @property
-    def favorites_counter(self):
-        return self.is_favorited.all().count()
-
-    favorites_counter.fget.short_description = 'В избранных'
+    counter_fields = ('favorites_counter',)
 
     @property
     def ingredients_names(self):
@@ -125,6 +153,10 @@ class Recipe(models.Model):
         ordering = ('-pub_date',)
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = [
+            models.Index(fields=['pub_date', 'id'],
+                         name='recipe_pub_date_id_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -221,3 +253,89 @@ class UserShoppingCart(RecipeUser):
 
     def __str__(self):
         return self.user.username + ' - ' + self.recipe.name
+
+
+class Job(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Готово'),
+        (FAILED, 'Ошибка'),
+    )
+
+    id = models.UUIDField(
+        primary_key=True,
+        default=uuid.uuid4,
+        editable=False,
+    )
+    status = models.CharField(
+        max_length=7,
+        choices=STATUSES,
+        default=PENDING,
+        db_index=True,
+        verbose_name='Статус',
+    )
+    created = models.DateTimeField(
+        auto_now_add=True,
+        db_index=True,
+        verbose_name='Создано',
+    )
+    started = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Начато',
+    )
+
+    class Meta:
+        abstract = True
+        ordering = ('created',)
+
+
+class ShoppingListJob(Job):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list_jobs',
+        verbose_name='Пользователь',
+    )
+    file_format = models.CharField(
+        max_length=4,
+        verbose_name='Формат',
+    )
+    file = models.FileField(
+        upload_to='shopping_lists/',
+        blank=True,
+        verbose_name='Файл',
+    )
+
+    class Meta(Job.Meta):
+        verbose_name = 'Выгрузка списка покупок'
+        verbose_name_plural = 'Выгрузки списков покупок'
+
+    def __str__(self):
+        return f'{self.user.username} - {self.created:%d.%m.%Y %H:%M}'
+
+
+class RecipeImageJob(Job):
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='image_jobs',
+        verbose_name='Рецепт',
+    )
+    upload = models.FileField(
+        upload_to='recipes/uploads/',
+        blank=True,
+        verbose_name='Загруженный файл',
+    )
+
+    class Meta(Job.Meta):
+        verbose_name = 'Обработка изображения'
+        verbose_name_plural = 'Обработка изображений'
+
+    def __str__(self):
+        return f'{self.recipe.name} - {self.created:%d.%m.%Y %H:%M}'
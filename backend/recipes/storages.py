@@ -0,0 +1,39 @@
+import hashlib
+import os
+
+from django.core.files.storage import FileSystemStorage
+from django.db import connection
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    # Файлы называются по SHA-256 содержимого, поэтому одинаковые
+    # изображения хранятся один раз. Файл удаляется только когда на него
+    # не ссылается ни один рецепт, см. api.images.release_image.
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        name = self.get_content_name(name, content)
+        # Блокировка держится до конца транзакции, которая сохранит ссылку
+        # на файл, поэтому release_image не удалит его в это время.
+        self.lock(name)
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length)
+
+    def lock(self, name):
+        key = int.from_bytes(hashlib.sha256(name.encode()).digest()[:8],
+                             'big', signed=True)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_xact_lock(%s)', [key])
+
+    def get_content_name(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        directory, filename = os.path.split(name)
+        _, extension = os.path.splitext(filename)
+        return os.path.join(directory,
+                            digest.hexdigest() + extension.lower())
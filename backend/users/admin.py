@@ -12,6 +12,8 @@ class UserAdmin(BaseUserAdmin):
 
 class FollowAdmin(admin.ModelAdmin):
     search_fields = ['follower__username', 'following__username']
+    list_select_related = ['follower', 'following']
+    autocomplete_fields = ['follower', 'following']
 
 
 admin.site.register(User, UserAdmin)
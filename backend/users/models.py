@@ -6,7 +6,22 @@ from django.db.models import CheckConstraint, F, Q, UniqueConstraint
 from users.validators import validate_username
 
 
-class User(AbstractUser):
+class CounterFieldsMixin:
+    # Поля-счётчики меняются только запросами UPDATE с F()-выражениями,
+    # поэтому save() уже загруженного объекта их не перезаписывает.
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.counter_fields
+            ]
+        super().save(*args, **kwargs)
+
+
+class User(CounterFieldsMixin, AbstractUser):
     username = models.CharField(
         validators=(validate_username,),
         max_length=settings.USER_PROFILE_LENGHT,
@@ -36,6 +51,24 @@ class User(AbstractUser):
         symmetrical=False,
         related_name='followers',
     )
+    shopping_cart_version = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Версия корзины',
+    )
+    recipes_counter = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество рецептов',
+    )
+    followers_counter = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество подписчиков',
+    )
+
+    counter_fields = ('shopping_cart_version', 'recipes_counter',
+                      'followers_counter')
 
     class Meta:
         ordering = ('username',)
@@ -45,18 +78,6 @@ class User(AbstractUser):
     def __str__(self):
         return self.username
 
-    @property
-    def recipes_counter(self):
-        return self.recipes.all().count()
-
-    recipes_counter.fget.short_description = 'Количество рецептов'
-
-    @property
-    def followers_counter(self):
-        return self.followers.all().count()
-
-    followers_counter.fget.short_description = 'Количество подписчиков'
-
 
 class Follow(models.Model):
     follower = models.ForeignKey(